@@ -0,0 +1,402 @@
+"""
+benchmarks.py - micro benchmarks for smokesignal dispatch
+
+Run with ``python benchmarks.py``. Each benchmark reports the best per-call time
+out of several timeit repeats, in microseconds.
+
+Results can be saved as a baseline and later runs compared against it::
+
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json
+
+Pass benchmark names to run only those, e.g. ``python benchmarks.py once_churn``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+import smokesignal
+
+
+benchmarks = []
+
+
+def benchmark(fn):
+    """
+    Registers a benchmark. Benchmarks are generators yielding (name, seconds) pairs
+    """
+    benchmarks.append(fn)
+    return fn
+
+
+def best(stmt, number=20000, repeat=5):
+    """
+    Returns the best per-call time of a callable across timeit repeats
+    """
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def make_receivers(count):
+    """
+    Returns a list of distinct no-op receivers
+    """
+    return [(lambda *a, **kw: None) for x in range(count)]
+
+
+def scaled(count, number=20000):
+    """
+    Returns a timeit number that keeps benchmarks over many receivers short
+    """
+    return max(20, number // max(count, 1))
+
+
+@benchmark
+def emit_overhead():
+    """
+    Per-emit overhead of dispatching through smokesignal versus calling the same
+    receivers by hand
+    """
+    for count in (0, 1, 10, 100, 1000):
+        callbacks = make_receivers(count)
+        for callback in callbacks:
+            smokesignal.on('bench', callback)
+
+        def by_hand():
+            for callback in callbacks:
+                callback(1, foo='bar')
+
+        number = scaled(count)
+        bound = smokesignal.signal('bench')
+        hand = best(by_hand, number=number)
+        emitted = best(lambda: smokesignal.emit('bench', 1, foo='bar'), number=number)
+        bound_emitted = best(lambda: bound.emit(1, foo='bar'), number=number)
+        smokesignal.clear_all()
+
+        yield 'emit %d receivers (by hand)' % count, hand
+        yield 'emit %d receivers' % count, emitted
+        yield 'emit %d receivers (overhead)' % count, emitted - hand
+        yield 'emit %d receivers (bound signal)' % count, bound_emitted
+
+
+@benchmark
+def emit_unknown():
+    """
+    Emitting or checking a signal nothing responds to, with and without patterns
+    registered
+    """
+    smokesignal.on('bench', lambda: None)
+    yield 'emit unknown signal', best(lambda: smokesignal.emit('unknown'))
+    yield 'has_receivers unknown signal', best(lambda: smokesignal.has_receivers('unknown'))
+    yield ('emit_lazy unknown signal',
+           best(lambda: smokesignal.emit_lazy('unknown', dict)))
+
+    smokesignal.on('other.*', lambda: None)
+    yield ('emit unknown signal (patterns)',
+           best(lambda: smokesignal.emit('unknown.signal')))
+    smokesignal.clear_all()
+
+
+@benchmark
+def registry_size():
+    """
+    Emitting, registering, looking up and clearing with many signals registered
+    """
+    callback = lambda: None
+
+    for size in (1000, 10000, 100000):
+        smokesignal.on(['bench%d' % x for x in range(size)], lambda: None)
+        label = '(%d signals)' % size
+
+        yield 'emit %s' % label, best(lambda: smokesignal.emit('bench0'))
+
+        def on_disconnect():
+            smokesignal.on('bench0', callback)
+            smokesignal.disconnect(callback)
+        yield 'on + disconnect %s' % label, best(on_disconnect)
+
+        smokesignal.on('bench0', callback)
+        yield 'signals %s' % label, best(lambda: smokesignal.signals(callback))
+
+        def on_clear():
+            smokesignal.on('cleared', callback)
+            smokesignal.clear('cleared')
+        yield 'on + clear %s' % label, best(on_clear)
+
+        smokesignal.clear_all()
+
+
+@benchmark
+def once_churn():
+    """
+    Registering a `once' callback and emitting it until it disconnects itself
+    """
+    callback = lambda: None
+    smokesignal.on('bench', lambda: None)
+
+    def churn():
+        smokesignal.once('bench', callback)
+        smokesignal.emit('bench')
+
+    yield 'once + emit', best(churn)
+    smokesignal.clear_all()
+
+
+@benchmark
+def disconnect_heavy():
+    """
+    Disconnecting a callback registered to many signals
+    """
+    callback = lambda: None
+
+    for count in (10, 100, 1000):
+        names = ['bench%d' % x for x in range(count)]
+        for name in names:
+            smokesignal.on(name, lambda: None)
+
+        def on_disconnect():
+            smokesignal.on(names, callback)
+            smokesignal.disconnect(callback)
+
+        yield ('on + disconnect %d signals' % count,
+               best(on_disconnect, number=scaled(count, 2000)))
+        smokesignal.clear_all()
+
+
+@benchmark
+def register_many():
+    """
+    Registering many receivers to one signal and then disconnecting them, per receiver
+    """
+    for count in (1000, 4000):
+        receivers = make_receivers(count)
+
+        def register():
+            for receiver in receivers:
+                smokesignal.on('bench', receiver)
+
+        def disconnect():
+            for receiver in receivers:
+                smokesignal.disconnect(receiver)
+
+        registering, disconnecting = [], []
+        for x in range(3):
+            registering.append(timeit.timeit(register, number=1))
+            disconnecting.append(timeit.timeit(disconnect, number=1))
+        yield 'on 1 of %d receivers' % count, min(registering) / count
+        yield 'disconnect 1 of %d receivers' % count, min(disconnecting) / count
+
+
+@benchmark
+def emit_twisted():
+    """
+    Emitting with the Twisted backend to synchronous receivers, and to receivers
+    returning deferreds, which are gathered with a DeferredList
+    """
+    backend = smokesignal._backend
+    if not smokesignal.set_backend('twisted'):
+        return
+
+    from twisted.internet import defer
+
+    for count in (1, 10, 100):
+        for callback in make_receivers(count):
+            smokesignal.on('bench', callback)
+
+        yield ('emit twisted %d receivers' % count,
+               best(lambda: smokesignal.emit('bench', 1), number=scaled(count)))
+        smokesignal.clear_all()
+
+        for x in range(count):
+            smokesignal.on('bench', lambda *a: defer.succeed(None))
+
+        yield ('emit twisted %d deferred receivers' % count,
+               best(lambda: smokesignal.emit('bench', 1), number=scaled(count)))
+        smokesignal.clear_all()
+
+    smokesignal.set_backend(backend)
+
+
+@benchmark
+def import_time():
+    """
+    Importing smokesignal in a fresh interpreter, as measured by ``python -X importtime``.
+    Only available on Python 3.7 and later
+    """
+    if sys.version_info < (3, 7):
+        return
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, '-X', 'importtime', '-c', 'import smokesignal']
+
+    timings = []
+    for x in range(10):
+        output = subprocess.check_output(command, cwd=here, stderr=subprocess.STDOUT)
+        for line in output.decode().splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'smokesignal':
+                timings.append(int(fields[1]) / 1e6)
+
+    yield 'import smokesignal', min(timings)
+
+
+@benchmark
+def emit_many_batches():
+    """
+    Delivering 1000 payloads with an emit per payload, with `emit_many' to ordinary
+    receivers and with `emit_many' to batch receivers
+    """
+    payloads = list(range(1000))
+
+    for count in (1, 10, 100):
+        callbacks = make_receivers(count)
+
+        for callback in callbacks:
+            smokesignal.on('bench', callback)
+
+        def per_item():
+            for payload in payloads:
+                smokesignal.emit('bench', payload)
+
+        yield 'emit 1000 payloads to %d receivers' % count, best(per_item, number=20)
+        yield ('emit_many 1000 payloads to %d receivers' % count,
+               best(lambda: smokesignal.emit_many('bench', payloads), number=20))
+        smokesignal.clear_all()
+
+        for callback in callbacks:
+            smokesignal.on('bench', callback, batch=True)
+        yield ('emit_many 1000 payloads to %d batch receivers' % count,
+               best(lambda: smokesignal.emit_many('bench', payloads), number=20))
+        smokesignal.clear_all()
+
+
+@benchmark
+def match_fanout():
+    """
+    Emitting to one of 5000 tenants, with each receiver checking the tenant itself
+    versus receivers registered with ``match``
+    """
+    def checking(tenant):
+        def callback(**kwargs):
+            if kwargs['tenant'] != tenant:
+                return
+        return callback
+
+    for x in range(5000):
+        smokesignal.on('bench', checking('tenant%d' % x))
+    yield ('emit to 1 of 5000 (checked by receivers)',
+           best(lambda: smokesignal.emit('bench', tenant='tenant42'), number=200))
+    smokesignal.clear_all()
+
+    for x in range(5000):
+        smokesignal.on('bench', lambda **kwargs: None, match={'tenant': 'tenant%d' % x})
+    yield ('emit to 1 of 5000 (match)',
+           best(lambda: smokesignal.emit('bench', tenant='tenant42')))
+
+    smokesignal.on('bench', lambda **kwargs: None,
+                   match=lambda kwargs: kwargs['tenant'] == 'tenant42')
+    yield ('emit to 1 of 5000 (match + predicate)',
+           best(lambda: smokesignal.emit('bench', tenant='tenant42')))
+    smokesignal.clear_all()
+
+
+@benchmark
+def match_registration():
+    """
+    Registering and then disconnecting receivers with ``match``, one per tenant of a
+    signal, per receiver
+    """
+    for count in (1000, 5000):
+        receivers = make_receivers(count)
+
+        def register():
+            for x, receiver in enumerate(receivers):
+                smokesignal.on('bench', receiver, match={'tenant': 'tenant%d' % x})
+
+        def disconnect():
+            for receiver in receivers:
+                smokesignal.disconnect(receiver)
+
+        registering, disconnecting = [], []
+        for x in range(3):
+            registering.append(timeit.timeit(register, number=1))
+            disconnecting.append(timeit.timeit(disconnect, number=1))
+        yield 'on 1 of %d tenants (match)' % count, min(registering) / count
+        yield 'disconnect 1 of %d tenants (match)' % count, min(disconnecting) / count
+
+
+@benchmark
+def rate_limits():
+    """
+    Emitting to a receiver whose emissions are dropped by throttling or sampling, or
+    merged by debouncing
+    """
+    for option, value in (('throttle', 60), ('sample', 0.01), ('debounce', 60)):
+        smokesignal.on('bench', lambda *a, **kw: None, **{option: value})
+        yield ('emit %s receiver' % option,
+               best(lambda: smokesignal.emit('bench', 1, foo='bar')))
+        smokesignal.clear_all()
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each result next to its baseline and returns the names of results slower
+    than the baseline by more than threshold
+    """
+    regressions = []
+    for name, seconds in results:
+        before = baseline.get(name)
+        if before is None:
+            print('%-45s %10.3f usec %10s' % (name, seconds * 1e6, 'new'))
+            continue
+
+        ratio = seconds / before if before > 0 else 1.0
+        flag = ''
+        if ratio > threshold and seconds - before > 1e-8:
+            flag = '  << slower'
+            regressions.append(name)
+        print('%-45s %10.3f usec %10.3f usec %6.2fx%s'
+              % (name, seconds * 1e6, before * 1e6, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark smokesignal dispatch')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, default all')
+    parser.add_argument('--save', metavar='FILE', help='save results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a baseline')
+    parser.add_argument('--threshold', type=float, default=1.10,
+                        help='slowdown ratio reported as a regression (default 1.10)')
+    options = parser.parse_args(argv)
+
+    selected = [fn for fn in benchmarks
+                if not options.names or fn.__name__ in options.names]
+
+    results = []
+    for fn in selected:
+        for name, seconds in fn():
+            results.append((name, seconds))
+            if not options.compare:
+                print('%-45s %10.3f usec' % (name, seconds * 1e6))
+
+    regressions = []
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.threshold)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(dict(results), f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('%d benchmarks regressed by more than %.0f%%'
+              % (len(regressions), (options.threshold - 1) * 100))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
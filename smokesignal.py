@@ -1,260 +1,2903 @@
 """
 smokesignal.py - simple event signaling
 """
+import bisect
+import errno
+import heapq
+import itertools
+import math
+import os
+import struct
+import sys
+import threading
+import time
 import types
+import weakref
 
-from collections import defaultdict
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 from functools import partial
 
 
-__all__ = ['emit', 'emitting', 'signals', 'responds_to', 'on', 'once',
-           'disconnect', 'disconnect_from', 'clear', 'clear_all']
+__all__ = ['emit', 'emit_lazy', 'emit_reduce', 'emit_results', 'first_non_none',
+           'emit_many', 'emit_async', 'emit_futures', 'emitting', 'BufferedSignal',
+           'flush_all', 'BackgroundDispatcher', 'ProcessBus', 'EmitError', 'CircuitBreaker',
+           'set_backend', 'install_twisted', 'install_asyncio', 'set_error_policy',
+           'StopPropagation', 'Hook', 'Stats', 'add_hook', 'remove_hook', 'instrument', 'stats', 'signals', 'responds_to', 'on', 'once', 'disconnect',
+           'disconnect_from', 'clear', 'clear_all', 'has_receivers', 'Dispatcher', 'Signal',
+           'signal']
 
 
-# Collection of receivers/callbacks
-receivers = defaultdict(set)
+# The plan of a signal nothing responds to
+_no_plan = ((), None, None)
 
+# Default of `on' options that are kept from an earlier registration unless given
+_unset = object()
+
+# Sequence numbers of registrations, which order callbacks of the same priority
+_sequence = itertools.count()
+
+# Plans memoized for signals that only receive through patterns, per dispatcher
+_matches_limit = 10000
+
+# Every live Dispatcher, so hooks can be compiled into all of their plans
+_dispatchers = weakref.WeakSet()
+
+# Guards the dispatch hooks. Each dispatcher has its own lock for its registry
+_lock = threading.RLock()
+
+# Every live BufferedSignal, so `flush_all' can deliver whatever they hold
+_buffers = weakref.WeakSet()
+
+# Dispatch hooks, see `add_hook'. While there are any, plans are compiled with every
+# callback wrapped so its calls are reported to the hooks
+_hooks = ()
+
+# The `Stats' hook installed by `instrument'
+_stats = None
+
+_clock = getattr(time, 'perf_counter', time.time)
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# The emit backend chosen with `set_backend'. Until 'auto' settles on one, emitting
+# goes through `Dispatcher._emit_auto'
+_backend = 'auto'
+_backends = ('auto', 'sync', 'twisted', 'asyncio')
+_twisted_support = False
+
+# How routed callbacks are called, `maybeDeferred' with the Twisted backend. Twisted
+# modules are only imported once that backend is chosen
 _call_partial = None
+_defer = None
+_Failure = None
+
+_coroutine_type = getattr(types, 'CoroutineType', None)
+
+# Framing of emissions sent by `ProcessBus': the sizes of the signal name and of the
+# pickled args and kwargs that follow. Datagrams hold as many frames as fit the limit
+_bus_frame = struct.Struct('!HI')
+_bus_datagram_limit = 65536
+
+
+class StopPropagation(Exception):
+    """
+    Raised by a callback to keep the signal it is handling from the callbacks after it
+    """
+
+
+class EmitError(Exception):
+    """
+    Raised by emitting under the 'group' error policy once every callback has been
+    called, if any of them failed. `failures' is a list of (callback, exception) pairs
+    """
+    def __init__(self, failures):
+        super(EmitError, self).__init__('%d signal callbacks failed' % len(failures))
+        self.failures = failures
+
+
+def set_backend(backend):
+    """
+    Chooses what `emit' does for every dispatcher and bound signal, not just the
+    module-level functions. The backend is one of:
+
+    - 'sync' calls callbacks and returns once they have all been called
+    - 'twisted' returns a DeferredList of the callback results, see `install_twisted'
+    - 'asyncio' behaves like `emit_async', see `install_asyncio'
+    - 'auto' settles on 'twisted' at the first emit if the application has already
+      imported Twisted's deferreds, and on 'sync' otherwise. The default
+
+    Twisted is only imported once its backend is chosen, so importing smokesignal never
+    imports it.
+
+    :param backend: The name of a backend
+    :returns: True if the backend is in use, False if it isn't available
+    """
+    global _backend, _twisted_support, _call_partial, _defer, _Failure
+    if backend not in _backends:
+        raise ValueError('Unknown backend: %r' % (backend,))
+
+    if backend == 'twisted':
+        try:
+            from twisted.internet import defer
+            from twisted.python.failure import Failure
+        except ImportError:
+            return False
+        _defer, _Failure = defer, Failure
+        _call_partial = defer.maybeDeferred
+        _use_emit(Dispatcher._emit_twisted, Signal._relay)
+    elif backend == 'asyncio':
+        _call_partial = _call_direct
+        _use_emit(Dispatcher.emit_async, Signal._relay)
+    elif backend == 'sync':
+        _call_partial = _call_direct
+        _use_emit(Dispatcher._emit_sync, Signal._emit_sync)
+    else:
+        _call_partial = _call_direct
+        _use_emit(Dispatcher._emit_auto, Signal._relay)
+
+    _backend = backend
+    _twisted_support = backend == 'twisted'
+    return True
+
+
+def _settle_backend():
+    """
+    Settles the 'auto' backend on Twisted if the application has already imported
+    `twisted.internet.defer', and on 'sync' otherwise. Other backends are kept
+    """
+    if _backend == 'auto':
+        defer = sys.modules.get('twisted.internet.defer')
+        set_backend('twisted' if defer is not None else 'sync')
+
 
 def install_twisted():
     """
-    If twisted is available, make `emit' return a DeferredList
+    If twisted is available, make `emit' return a DeferredList. This applies to every
+    dispatcher and bound signal, not just the module-level functions
 
     This has been successfully tested with Twisted 14.0 and later.
     """
-    global emit, _call_partial
-    try:
-        from twisted.internet import defer
-        emit = _emit_twisted
-        _call_partial = defer.maybeDeferred
-        return True
-    except ImportError:
-        _call_partial = lambda fn, *a, **kw: fn(*a, **kw)
-        return False
+    return set_backend('twisted')
+
 
-def emit(signal, *args, **kwargs):
+def install_asyncio():
     """
-    Emits a single signal to call callbacks registered to respond to that signal.
-    Optionally accepts args and kwargs that are passed directly to callbacks.
+    Makes `emit' behave like `emit_async', returning an awaitable that gathers the
+    results of all callbacks. This applies to every dispatcher and bound signal, not
+    just the module-level functions
+    """
+    return set_backend('asyncio')
 
-    :param signal: Signal to send
+
+def _use_emit(method, signal_emit):
     """
-    for callback in set(receivers[signal]):  # Make a copy in case of any ninja signals
-        _call(callback, args=args, kwargs=kwargs)
+    Replaces `emit' of every dispatcher, and of the module, with another method of
+    `Dispatcher', and `emit' of every bound signal with a method of `Signal'. Bound
+    signals only follow their plan themselves with the sync backend, otherwise they
+    emit through their dispatcher
+    """
+    global emit
+    Dispatcher.emit = method
+    Signal.emit = signal_emit
+    emit = _default.emit
+
 
-def _emit_twisted(signal, *args, **kwargs):
+class Dispatcher(object):
     """
-    Emits a single signal to call callbacks registered to respond to that signal.
-    Optionally accepts args and kwargs that are passed directly to callbacks.
+    A registry of signals and the callbacks responding to them. Each dispatcher is
+    independent of every other, so subsystems can keep their signals to themselves::
 
-    :param signal: Signal to send
+        bus = smokesignal.Dispatcher()
+        bus.on('foo', my_callback)
+        bus.emit('foo')
+
+    The module-level functions, such as `smokesignal.on' and `smokesignal.emit', are
+    the methods of a default dispatcher
+
+    :param error_policy: How errors raised by callbacks are handled. See
+                         `set_error_policy'
     """
-    errback = kwargs.pop('errback', lambda f: f)
+    __slots__ = ('receivers', 'error_policy', '_plans', '_budgets', '_rates', '_filters',
+                 '_seqs', '_matches', '_patterns', '_index', '_signals', '_lock',
+                 '__weakref__')
+
+    def __init__(self, error_policy='raise'):
+        # Collection of receivers/callbacks. Each signal maps to an immutable tuple of
+        # callbacks that is replaced wholesale whenever it changes, so `emit' can
+        # iterate the current tuple directly without copying it. Lookups never insert,
+        # and signals are removed as soon as they have no receivers left
+        self.receivers = {}
+
+        # Compiled dispatch plans, published alongside `receivers'. Each plan is a
+        # triple of the callbacks to call, including those of matching signal patterns,
+        # a dict of the callbacks in it that must be routed through `_call' for a call
+        # limit, an executor or batching, or None when every callback can be called
+        # directly, and the `_Filters' selecting which callbacks an emit calls, or None
+        # if every emit calls all of them. The dict maps each routed callback to the
+        # signal or pattern whose call limit it is under, or None if it has none
+        self._plans = {}
+
+        # Remaining calls of callbacks registered with a call limit, keyed by the
+        # signal or pattern they were registered to and the callback. Limits are per
+        # signal, so one callback can have different limits on different signals
+        self._budgets = {}
+
+        # Rate limits of callbacks registered with `throttle', `debounce' or `sample',
+        # and filters of callbacks registered with `match', keyed like `_budgets'
+        self._rates = {}
+        self._filters = {}
+
+        # Sequence number of every registration, keyed like `_budgets'. Callbacks of
+        # the same priority are called in the order they were registered, whether to
+        # the signal itself or to patterns matching it, so plans are sorted by these
+        self._seqs = {}
+
+        # Signal patterns, such as 'order.*' or 'order.#', are kept in a trie of their
+        # dot-separated segments. Plans for signals that only receive through patterns
+        # are resolved from the trie on first emit and memoized until the next pattern
+        # change
+        self._patterns = _PatternTrie()
+        self._matches = {}
+
+        # Reverse index of each callback to the set of signals it responds to,
+        # maintained alongside `receivers' so `signals' and `disconnect' never scan
+        # the whole registry
+        self._index = {}
+
+        # Signal objects bound by `signal', which are handed their plans directly
+        self._signals = weakref.WeakValueDictionary()
+
+        # Guards every change to the registry, along with the remaining calls of
+        # limited callbacks. Emitting never takes it: it only reads the published
+        # dispatch plans. Reentrant, since weak receivers may disconnect themselves
+        # from within a change
+        self._lock = threading.RLock()
+
+        self.set_error_policy(error_policy)
+        _dispatchers.add(self)
+
+    def emit(self, signal, *args, **kwargs):
+        """
+        Emits a single signal to call callbacks registered to respond to that signal.
+        Optionally accepts args and kwargs that are passed directly to callbacks.
+        Callbacks are called in order of priority, and any of them can raise
+        `StopPropagation' to keep the signal from the callbacks after it. Errors raised
+        by callbacks are handled according to the error policy, see `set_error_policy'.
+
+        :param signal: Signal to send
+        """
+        callbacks, routed = self._plan_for(signal, kwargs)
+
+        # After a failure, the loop resumes from the callback after the failed one
+        remaining = iter(callbacks)
+        failures = None
+        while True:
+            try:
+                if routed is None:
+                    for callback in remaining:
+                        callback(*args, **kwargs)
+                else:
+                    for callback in remaining:
+                        if callback in routed:
+                            self._call(callback, args, kwargs, limit=routed[callback],
+                                       signal=signal)
+                        else:
+                            callback(*args, **kwargs)
+                break
+            except StopPropagation:
+                break
+            except Exception as e:
+                if self.error_policy == 'raise':
+                    raise
+                failures = self._failed(signal, callback, e, failures)
+
+        if failures:
+            raise EmitError(failures)
+
+    _emit_sync = emit
+
+    def _emit_auto(self, signal, *args, **kwargs):
+        """
+        Emits with the backend the 'auto' backend settles on, which replaces this method
+        from then on. See `set_backend'. An `emit' captured before then, such as the
+        module-level function imported by name, keeps coming here, so it only settles
+        while the backend is still 'auto' and otherwise emits with the one in use
+        """
+        _settle_backend()
+        return type(self).emit(self, signal, *args, **kwargs)
+
+    def set_error_policy(self, policy):
+        """
+        Sets how errors raised by callbacks are handled when emitting. The policy is one
+        of:
+
+        - 'raise' raises the first error, skipping the callbacks after it. The default
+        - 'group' calls every callback, then raises an `EmitError' of all the failures
+        - 'log' logs every error to the 'smokesignal' logger and carries on
+        - a `CircuitBreaker', which logs errors like 'log', and disconnects callbacks
+          that fail too often
+
+        This applies to callbacks called by `emit', `emit_many' and `emit_async', and
+        to Twisted failures that aren't handled by an errback. Callbacks bound to an
+        executor fail after `emit' and `emit_many' return, so their errors are logged
+        under every policy, and counted by a `CircuitBreaker'. Futures from
+        `emit_futures' always hold their own errors
+
+        :param policy: An error policy
+        """
+        if policy not in ('raise', 'group', 'log') and not isinstance(policy, CircuitBreaker):
+            raise ValueError('Unknown error policy: %r' % (policy,))
+        self.error_policy = policy
+
+    def _failed(self, signal, callback, error, failures):
+        """
+        Handles an error raised by a callback under any policy other than 'raise'.
+        Under the 'group' policy the failure is added to `failures', which is created
+        if it is None
+
+        :returns: The list of failures to raise, if any
+        """
+        if self.error_policy == 'group':
+            if failures is None:
+                failures = []
+            failures.append((callback, error))
+        else:
+            self._recover(signal, callback, error)
+        return failures
+
+    def _recover(self, signal, callback, error):
+        """
+        Logs an error raised by a callback and carries on, counting it against the
+        callback if the policy is a `CircuitBreaker'
+        """
+        _log.error('Callback %r for signal %r failed', callback, signal, exc_info=error)
+        if isinstance(self.error_policy, CircuitBreaker):
+            self.error_policy.failed(self, callback)
+
+    def emit_lazy(self, signal, factory, **kwargs):
+        """
+        Emits a signal with a payload that is only built if something responds to the
+        signal, for payloads that are expensive to build. Optionally accepts kwargs that
+        are passed directly to callbacks.
+
+        :param signal: Signal to send
+        :param factory: A callable taking no arguments that returns the payload, which
+                        is passed as the only positional argument of each call
+        :returns: Whatever `emit' returns. If nothing responds to the signal with these
+                  kwargs, what `emit' returns when no callback is called: None, or an
+                  empty list in a deferred or an awaitable
+        """
+        if not self._plan_for(signal, kwargs)[0]:
+            return self._unheard()
+        return self.emit(signal, factory(), **kwargs)
+
+    def _unheard(self):
+        """
+        Returns what `emit' returns when no callback is called, for the backend in use
+        """
+        _settle_backend()
+        if _backend == 'twisted':
+            return _defer.succeed([])
+        if _backend == 'asyncio':
+            import asyncio
+            try:
+                future = asyncio.get_running_loop().create_future()
+            except RuntimeError:
+                raise RuntimeError('emit_async must be called with an event loop running')
+            future.set_result([])
+            return future
+        return None
+
+    def emit_reduce(self, signal, reducer, *args, **kwargs):
+        """
+        Emits a signal and reduces the results of its callbacks to a single value. The
+        reducer is called with an iterator that calls each callback as its result is
+        needed, so a reducer that stops early, like `any', `all' or `first_non_none',
+        leaves the remaining callbacks uncalled::
+
+            vetoed = smokesignal.emit_reduce('pre_save', any, obj)
+
+        Callbacks are always called synchronously, whatever `emit' does. Callbacks that
+        aren't called because of a call limit, or that fail and are not raised by the
+        error policy, have no result. Optionally accepts args and kwargs that are passed
+        directly to callbacks.
+
+        :param signal: Signal to send
+        :param reducer: A callable taking an iterable of results
+        :returns: Whatever the reducer returns
+        """
+        failures = []
+        result = reducer(self._results(signal, args, kwargs, failures))
+        if failures:
+            raise EmitError(failures)
+        return result
+
+    def emit_results(self, signal, *args, **kwargs):
+        """
+        Emits a signal, calling its callbacks synchronously, and returns the list of
+        their results in the order they were called. See `emit_reduce'
+
+        :param signal: Signal to send
+        :returns: A list of callback results
+        """
+        return self.emit_reduce(signal, list, *args, **kwargs)
+
+    def _results(self, signal, args, kwargs, failures):
+        """
+        Calls the callbacks of a signal one at a time for `emit_reduce', yielding their
+        results. Callbacks bound to an executor yield the future of their result
+        """
+        callbacks, routed = self._plan_for(signal, kwargs)
+        for callback in callbacks:
+            try:
+                prepared = self._prepare(callback, routed, args, kwargs)
+                if prepared is None:
+                    continue
+                executor, call_args = prepared
+                if executor is not None:
+                    result = executor.submit(callback, *call_args, **kwargs)
+                else:
+                    result = callback(*call_args, **kwargs)
+            except StopPropagation:
+                return
+            except Exception as e:
+                if self.error_policy == 'raise':
+                    raise
+                self._failed(signal, callback, e, failures)
+                continue
+
+            yield result
+
+    def emit_many(self, signal, payloads, **kwargs):
+        """
+        Emits a signal once for each of many payloads. Callbacks registered with `batch'
+        are called once with the list of all payloads, while all other callbacks are called
+        once per payload, as with `emit'. Each callback receives every payload before the
+        next callback is called. A callback raising `StopPropagation' keeps the payload it
+        was called with from later callbacks. Optionally accepts kwargs that are passed to
+        every call. Errors are handled according to the error policy, and a failing call
+        doesn't keep its payload from later callbacks.
+
+        :param signal: Signal to send
+        :param payloads: An iterable of payloads, each passed as the only positional
+                         argument of a call
+        """
+        callbacks, routed = self._plan_for(signal, kwargs)
+        if not callbacks:
+            return
+
+        payloads = list(payloads)
+        failures = []
+
+        for callback in callbacks:
+            if not payloads:
+                break
+
+            is_routed = routed is not None and callback in routed
+            limit = routed[callback] if is_routed else None
+            if is_routed and getattr(callback, '_batch', False):
+                try:
+                    self._call(callback, payloads, kwargs, direct=True, limit=limit,
+                               signal=signal)
+                except StopPropagation:
+                    break
+                except Exception as e:
+                    if self.error_policy == 'raise':
+                        raise
+                    self._failed(signal, callback, e, failures)
+                continue
+
+            stopped = self._deliver(signal, callback, payloads, kwargs, is_routed, limit,
+                                    failures)
+            if stopped:
+                payloads = [p for i, p in enumerate(payloads) if i not in stopped]
+
+        if failures:
+            raise EmitError(failures)
+
+    def _deliver(self, signal, callback, payloads, kwargs, routed, limit, failures):
+        """
+        Calls a callback once per payload for `emit_many', returning the positions of any
+        payloads the callback stopped from propagating. Failures are handled by the error
+        policy, and collected in `failures' under the 'group' policy
+        """
+        stopped = set()
+        remaining = iter(payloads)
+        while True:
+            try:
+                if routed:
+                    for payload in remaining:
+                        self._call(callback, (payload,), kwargs, direct=True,
+                                   limit=limit, signal=signal)
+                elif kwargs:
+                    for payload in remaining:
+                        callback(payload, **kwargs)
+                else:
+                    for payload in remaining:
+                        callback(payload)
+                return stopped
+            except StopPropagation:
+                # The iterator is already past the payload that stopped, so going round
+                # again resumes with the next one
+                stopped.add(len(payloads) - remaining.__length_hint__() - 1)
+            except Exception as e:
+                if self.error_policy == 'raise':
+                    raise
+                self._failed(signal, callback, e, failures)
+
+    def _emit_twisted(self, signal, *args, **kwargs):
+        """
+        Emits a single signal to call callbacks registered to respond to that signal.
+        Optionally accepts args and kwargs that are passed directly to callbacks.
+        Failures not handled by the optional `errback' are handled according to the
+        error policy. Returns a deferred that resolves to the list of callback results.
+
+        Only the deferreds returned by callbacks are waited on with a DeferredList. If
+        every callback returns synchronously, the results are returned in a single
+        deferred that has already fired.
+
+        :param signal: Signal to send
+        """
+        errback = kwargs.pop('errback', None)
+        policy = self.error_policy
+
+        results = []
+        pending = None
+        callbacks, routed = self._plan_for(signal, kwargs)
+        for callback in callbacks:
+            try:
+                prepared = self._prepare(callback, routed, args, kwargs)
+                if prepared is None:
+                    continue
+                executor, call_args = prepared
+                if executor is not None:
+                    result = self._submit(executor, signal, callback, call_args, kwargs)
+                else:
+                    result = callback(*call_args, **kwargs)
+            except StopPropagation:
+                break
+            except Exception:
+                result = _defer.fail(_Failure())
+            else:
+                # Failures and coroutines are wrapped in deferreds like `maybeDeferred' would
+                if isinstance(result, _Failure) or type(result) is _coroutine_type:
+                    result = _defer.maybeDeferred(lambda: result)
+
+            if not isinstance(result, _defer.Deferred):
+                results.append(result)
+                continue
+
+            # A callback can only stop propagation by failing synchronously
+            failure = result.result if result.called else None
+            if isinstance(failure, _Failure) and failure.check(StopPropagation):
+                result.addErrback(lambda f: None)
+                break
+
+            if errback is not None:
+                result.addErrback(errback)
+            if policy != 'raise' and policy != 'group':
+                result.addErrback(lambda f, cb=callback: self._recover(signal, cb, f.value))
+
+            if pending is None:
+                pending = []
+            pending.append((len(results), callback, result))
+            results.append(None)
+
+        if pending is None:
+            return _defer.succeed(results)
+
+        deferreds = _defer.DeferredList([d for index, callback, d in pending],
+                                        consumeErrors=policy == 'group')
+        return deferreds.addCallback(_gathered, results, pending, policy)
+
+    def emit_async(self, signal, *args, **kwargs):
+        """
+        Emits a single signal to call callbacks registered to respond to that signal, for
+        use with asyncio. Synchronous callbacks are called inline, while any awaitables
+        returned by callbacks run concurrently. Returns an awaitable that resolves to the
+        list of callback results, in the order the callbacks were called.
+
+        Only synchronous callbacks can stop propagation, since awaitables returned by
+        earlier callbacks are already running.
+
+        Two optional keyword arguments are consumed rather than passed to callbacks:
+        `timeout' is the number of seconds each callback's awaitable may take before it
+        fails with `asyncio.TimeoutError', and `return_exceptions' collects exceptions
+        into the results instead of raising the first one. Otherwise, errors are handled
+        according to the error policy, with None in the results for callbacks that failed
+        and were not raised.
+
+        Must be called from the thread running the event loop, while it runs.
+
+        :param signal: Signal to send
+        """
+        import asyncio
+        from inspect import isawaitable
+
+        timeout = kwargs.pop('timeout', None)
+        return_exceptions = kwargs.pop('return_exceptions', False)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError('emit_async must be called with an event loop running')
+
+        pending = []
+        called = []
+        callbacks, routed = self._plan_for(signal, kwargs)
+        for callback in callbacks:
+            prepared = self._prepare(callback, routed, args, kwargs)
+            if prepared is None:
+                continue
+            executor, call_args = prepared
+
+            # Every result is gathered as an awaitable, so errors are reported the same
+            # way whether a callback is synchronous or not
+            try:
+                if executor is not None:
+                    future = executor.submit(callback, *call_args, **kwargs)
+                    result = asyncio.wrap_future(future)
+                else:
+                    result = callback(*call_args, **kwargs)
+            except StopPropagation:
+                break
+            except Exception as e:
+                result = loop.create_future()
+                result.set_exception(e)
+            else:
+                if not isawaitable(result):
+                    value, result = result, loop.create_future()
+                    result.set_result(value)
+                elif timeout is not None:
+                    result = asyncio.wait_for(result, timeout)
+
+            pending.append(result)
+            called.append(callback)
+
+        policy = self.error_policy
+        if return_exceptions or policy == 'raise':
+            return asyncio.gather(*pending, return_exceptions=return_exceptions)
+
+        # Every result is gathered, then the failures are handled by the policy
+        outcome = loop.create_future()
+
+        def handle(gathered):
+            if gathered.cancelled():
+                outcome.cancel()
+                return
+
+            results, failures = gathered.result(), []
+            for i, (callback, result) in enumerate(zip(called, results)):
+                if isinstance(result, Exception):
+                    self._failed(signal, callback, result, failures)
+                    results[i] = None
+
+            if failures:
+                outcome.set_exception(EmitError(failures))
+            else:
+                outcome.set_result(results)
 
-    dl = []
-    for callback in set(receivers[signal]):  # Make a copy in case of any ninja signals
-        d = _call(callback, args=args, kwargs=kwargs)
-        if d is not None:
-            dl.append(d.addErrback(errback))
+        asyncio.gather(*pending, return_exceptions=True).add_done_callback(handle)
+        return outcome
 
-    def simplify(results):
-        return [x[1] for x in results]
+    def emit_futures(self, signal, *args, **kwargs):
+        """
+        Emits a single signal to call callbacks registered to respond to that signal,
+        running them on executors from `concurrent.futures'. Returns a list of futures for
+        the callback results, in the order the callbacks were called.
 
-    from twisted.internet.defer import DeferredList
-    return DeferredList(dl).addCallback(simplify)
+        Callbacks registered with an executor always run on it. The optional `executor'
+        keyword argument, which is not passed to callbacks, sets the executor for all
+        other callbacks. Without one they run inline and their futures are already done,
+        and only these inline callbacks can stop propagation.
 
-@contextmanager
-def emitting(exit, enter=None):
+        :param signal: Signal to send
+        """
+        from concurrent.futures import Future
+
+        executor = kwargs.pop('executor', None)
+
+        futures = []
+        callbacks, routed = self._plan_for(signal, kwargs)
+        for callback in callbacks:
+            prepared = self._prepare(callback, routed, args, kwargs)
+            if prepared is None:
+                continue
+            runner, call_args = prepared
+            runner = runner or executor
+
+            if runner is not None:
+                futures.append(runner.submit(callback, *call_args, **kwargs))
+                continue
+
+            future = Future()
+            try:
+                future.set_result(callback(*call_args, **kwargs))
+            except StopPropagation:
+                break
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+
+        return futures
+
+    @contextmanager
+    def emitting(self, exit, enter=None):
+        """
+        Context manager for emitting signals either on enter or on exit of a context.
+        By default, if this context manager is created using a single arg-style argument,
+        it will emit a signal on exit. Otherwise, keyword arguments indicate signal points.
+        Emissions held by buffered signals of this dispatcher are flushed before the exit
+        signal is sent. The exit signal is sent even if flushing fails, and a flush error
+        raised while the block is already raising is logged rather than replacing it
+        """
+        if enter is not None:
+            self.emit(enter)
+
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            try:
+                self._flush_buffers()
+            except Exception:
+                if not failed:
+                    raise
+                _log.exception('Flushing buffered signals before %r failed', exit)
+            finally:
+                self.emit(exit)
+
+    def _flush_buffers(self):
+        """
+        Flushes the buffered signals that emit through this dispatcher
+        """
+        for buffered in list(_buffers):
+            if (buffered.dispatcher or _default) is self:
+                buffered.flush()
+
+    def signal(self, name):
+        """
+        Returns the `Signal' object for a signal of this dispatcher, which emits without
+        looking up the signal. Binding the same signal twice returns the same object for
+        as long as it is referenced
+
+        :param name: Signal to bind
+        :returns: A `Signal'
+        """
+        with self._lock:
+            bound = self._signals.get(name)
+            if bound is None:
+                bound = self._signals[name] = Signal(name, self)
+                bound._plan = self._plans.get(name) or self._resolve(name)
+            return bound
+
+    def signals(self, callback):
+        """
+        Returns a tuple of all signals for a particular callback
+
+        :param callback: A callable registered with smokesignal
+        :returns: Tuple of all signals callback responds to
+        """
+        with self._lock:
+            return tuple(self._index.get(callback, ()))
+
+    def has_receivers(self, signal, **kwargs):
+        """
+        Returns True if any callback would be called by emitting a signal, including
+        callbacks of matching patterns. Optionally accepts the kwargs the signal would
+        be emitted with, which callbacks registered with `match' are selected by.
+        Checking never registers the signal
+
+        :param signal: A signal to check
+        :returns: True if something responds to signal, False otherwise
+        """
+        return bool(self._plan_for(signal, kwargs)[0])
+
+    def responds_to(self, callback, signal):
+        """
+        Returns bool if callback will respond to a particular signal
+
+        :param callback: A callable registered with smokesignal
+        :param signal: A signal to check if callback responds
+        :returns: True if callback responds to signal, False otherwise
+        """
+        return (signal, callback) in self._seqs
+
+    def on(self, signals, callback=None, max_calls=None, weak=False, executor=_unset,
+           batch=_unset, priority=_unset, match=None, throttle=None, debounce=None, sample=None):
+        """
+        Registers a single callback for receiving an event (or event list). Optionally,
+        can specify a maximum number of times the callback should receive a signal. This
+        method works as both a function and a decorator::
+
+            smokesignal.on('foo', my_callback)
+
+            @smokesignal.on('foo')
+            def my_callback():
+                pass
+
+        :param signals: A single signal or list/tuple of signals that callback should respond to
+        :param callback: A callable that should repond to supplied signal(s)
+        :param max_calls: Integer maximum calls for callback. None for no limit.
+        :param weak: If True, only hold a weak reference to callback (or the instance of a
+                     bound method) and disconnect it once it is garbage collected
+        :param executor: A `concurrent.futures' executor that callback should run on, on
+                         every signal. If not given, an executor the callback was
+                         registered with before is kept. None to call it inline
+        :param batch: If True, callback receives a list of payloads rather than arguments,
+                      on every signal. See `emit_many'. If not given, the batch mode the
+                      callback was registered with before is kept
+        :param priority: Callbacks with higher priorities are called first. Callbacks with
+                         the same priority are called in the order they were registered.
+                         If not given, the priority the callback was registered with
+                         before is kept, or 0 for a new callback
+        :param match: Only call callback for emits whose keyword arguments match. Either a
+                      dict of the hashable values keyword arguments must equal, or a
+                      predicate called with the dict of keyword arguments. None to always
+                      call it
+        :param throttle: Seconds to drop emissions for after each call. None for no limit
+        :param debounce: Seconds without emissions to wait for before calling callback
+                         with the last of them, from the timer thread. None to call it
+                         right away
+        :param sample: The fraction of emissions, from 0 to 1, to call callback for. None
+                       to call it for all of them
+        """
+        if isinstance(callback, int) or callback is None:
+            # Decorated
+            if isinstance(callback, int):
+                # Here the args were passed arg-style, not kwarg-style
+                callback, max_calls = max_calls, callback
+            return partial(self._on, signals, max_calls=max_calls, weak=weak,
+                           executor=executor, batch=batch, priority=priority, match=match,
+                           throttle=throttle, debounce=debounce, sample=sample)
+        else:
+            # Function call
+            return self._on(signals, callback, max_calls=max_calls, weak=weak,
+                            executor=executor, batch=batch, priority=priority, match=match,
+                            throttle=throttle, debounce=debounce, sample=sample)
+
+    def _on(self, on_signals, callback, max_calls=None, weak=False, executor=_unset,
+            batch=_unset, priority=_unset, match=None, throttle=None, debounce=None, sample=None):
+        """
+        Proxy for `on`, which is compatible as both a function call and
+        a decorator. This method cannot be used as a decorator
+
+        :param signals: A single signal or list/tuple of signals that callback should respond to
+        :param callback: A callable that should repond to supplied signal(s)
+        :param max_calls: Integer maximum calls for callback. None for no limit.
+        :param weak: If True, only hold a weak reference to callback
+        :param executor: A `concurrent.futures' executor that callback should run on
+        :param batch: If True, callback receives a list of payloads rather than arguments
+        :param priority: Callbacks with higher priorities are called first
+        :param match: A dict of keyword argument values or a predicate, see `on'
+        :param throttle: Seconds to drop emissions for after each call
+        :param debounce: Seconds without emissions to wait for before calling callback
+        :param sample: The fraction of emissions to call callback for
+        """
+        if not callable(callback):
+            raise AssertionError('Signal callbacks must be callable')
+        if match is not None and not (isinstance(match, dict) or callable(match)):
+            raise AssertionError('Signal filters must be dicts or callable')
+        if isinstance(match, dict):
+            # Dict filters are indexed by their values when plans are published
+            try:
+                hash(tuple(match.values()))
+            except TypeError:
+                raise AssertionError('Signal filter values must be hashable, '
+                                     'use a predicate instead: %r' % (match,))
+
+        rate = None
+        if throttle is not None or debounce is not None or sample is not None:
+            rate = (throttle, debounce, sample)
+            if (throttle is not None and throttle <= 0 or
+                    debounce is not None and debounce <= 0 or
+                    sample is not None and not 0 < sample <= 1):
+                raise ValueError('Invalid throttle, debounce or sample: %r' % (rate,))
+
+        # Support for lists of signals
+        if not isinstance(on_signals, (list, tuple)):
+            on_signals = [on_signals]
+
+        # Bound methods can't carry the attributes set below, so they are registered
+        # through a receiver that stands in for them. Weak callbacks always are
+        if weak:
+            receiver = _WeakReceiver(callback, self)
+        elif isinstance(callback, types.MethodType):
+            receiver = _BoundReceiver(callback)
+        else:
+            receiver = callback
+
+        with self._lock:
+            # A callback registered before keeps the receiver it was registered through,
+            # and with it the options it was given
+            for signal in self.signals(receiver):
+                current = self.receivers[signal]
+                receiver = current[current.index(receiver)]
+                break
+
+            # The executor, batch mode and priority are shared by every signal the
+            # callback responds to, so the receivers of its existing signals may need
+            # reordering, or their plans may need to move it to the other dispatch path
+            was_routed = _routed(receiver)
+            was_priority = _priority(receiver)
+            known = receiver in self._index
+            if executor is not _unset or not known:
+                receiver._executor = None if executor is _unset else executor
+            if batch is not _unset or not known:
+                receiver._batch = False if batch is _unset else batch
+            if priority is not _unset or not known:
+                receiver._priority = 0 if priority is _unset else priority
+            if was_priority != _priority(receiver):
+                for signal in self.signals(receiver):
+                    self._publish(signal, self._ordered(signal, self.receivers[signal]))
+            elif was_routed != _routed(receiver):
+                for signal in self.signals(receiver):
+                    self._publish(signal, self.receivers[signal])
+
+            # Register the callback, with a call limit, a rate limit and a filter for each
+            # of these signals
+            for signal in on_signals:
+                key = (signal, receiver)
+                limited = key in self._budgets or key in self._rates
+                filtered = self._filters.get(key)
+                if max_calls is None:
+                    self._budgets.pop(key, None)
+                else:
+                    self._budgets[key] = max_calls
+                if match is None:
+                    self._filters.pop(key, None)
+                else:
+                    self._filters[key] = match
+
+                # Rate limits carry on from where they were unless their settings change
+                current = self._rates.get(key)
+                if current is not None and current.settings != rate:
+                    current.cancel()
+                    del self._rates[key]
+                if rate is not None and key not in self._rates:
+                    self._rates[key] = _Rate(*rate)
+
+                # An existing registration needs a new plan if it gained or lost a limit,
+                # or if its filter changed
+                added = self._add_receiver(signal, receiver)
+                if not added and (limited != (key in self._budgets or key in self._rates) or
+                                  filtered != match):
+                    self._publish(signal, self.receivers[signal])
+
+        # Partials are set on whatever is handed back to the caller: the callback itself
+        # or the receiver standing in for a bound method
+        if isinstance(callback, types.MethodType):
+            callback = receiver
+
+        # Setup responds_to partial for use later
+        if not hasattr(callback, 'responds_to'):
+            callback.responds_to = partial(self.responds_to, callback)
+
+        # Setup signals partial for use later.
+        if not hasattr(callback, 'signals'):
+            callback.signals = partial(self.signals, callback)
+
+        # Setup disconnect partial for user later
+        if not hasattr(callback, 'disconnect'):
+            callback.disconnect = partial(self.disconnect, callback)
+
+        # Setup disconnect_from partial for user later
+        if not hasattr(callback, 'disconnect_from'):
+            callback.disconnect_from = partial(self.disconnect_from, callback)
+
+        return callback
+
+    def once(self, signals, callback=None, **kwargs):
+        """
+        Registers a callback that will respond to an event at most one time. Accepts the
+        same keyword arguments as `on', other than `max_calls'
+
+        :param signals: A single signal or list/tuple of signals that callback should respond to
+        :param callback: A callable that should repond to supplied signal(s)
+        """
+        return self.on(signals, callback, max_calls=1, **kwargs)
+
+    def disconnect(self, callback):
+        """
+        Removes a callback from all signal registries and prevents it from responding
+        to any emitted signal.
+
+        :param callback: A callable registered with smokesignal
+        """
+        # This is basically what `disconnect_from` does, but that method guards against
+        # callbacks not responding to signal arguments. We don't need that because we're
+        # disconnecting all the valid ones here
+        with self._lock:
+            for signal in self.signals(callback):
+                self._remove_receiver(signal, callback)
+
+    def disconnect_from(self, callback, signals):
+        """
+        Removes a callback from specified signal registries and prevents it from responding
+        to any emitted signal.
+
+        :param callback: A callable registered with smokesignal
+        :param signals: A single signal or list/tuple of signals
+        """
+        # Support for lists of signals
+        if not isinstance(signals, (list, tuple)):
+            signals = [signals]
+
+        # Remove callback from receiver list if it responds to the signal. This is
+        # checked again under the lock by `_remove_receiver'
+        for signal in signals:
+            if self.responds_to(callback, signal):
+                self._remove_receiver(signal, callback)
+
+    def clear(self, *signals):
+        """
+        Clears all callbacks for a particular signal or signals
+        """
+        if not signals:
+            return self.clear_all()
+
+        with self._lock:
+            for signal in signals:
+                for callback in self.receivers.get(signal, ()):
+                    self._unindex(callback, signal)
+                self._publish(signal, ())
+
+    def clear_all(self):
+        """
+        Clears all callbacks for all signals
+        """
+        with self._lock:
+            self.receivers.clear()
+            self._plans.clear()
+            self._budgets.clear()
+            for rate in self._rates.values():
+                rate.cancel()
+            self._rates.clear()
+            self._filters.clear()
+            self._seqs.clear()
+            self._index.clear()
+            self._matches.clear()
+            self._patterns = _PatternTrie()
+            for bound in list(self._signals.values()):
+                bound._plan = _no_plan
+
+    def _plan_for(self, signal, kwargs):
+        """
+        Returns the callbacks an emit of a signal with keyword arguments kwargs calls,
+        in order, and the dict of those among them routed through `_call' or None. Plans
+        are immutable snapshots, so ninja signals registered while emitting can't change
+        what this emit calls
+        """
+        return _selected(self._plans.get(signal) or self._resolve(signal), kwargs)
+
+    def _prepare(self, callback, routed, args, kwargs):
+        """
+        Prepares a call of a callback for an emit that calls routed callbacks itself
+        rather than through `_call'. A call of a callback under a call limit or a rate
+        limit is claimed first
+
+        :param routed: The dict of routed callbacks of the plan, or None
+        :returns: The executor the callback is bound to, or None, and the args to call
+                  it with, or None if it must not be called
+        """
+        if routed is None or callback not in routed:
+            return None, args
+        limit = routed[callback]
+        if limit is not None and not self._claim(limit, callback, args, kwargs):
+            return None
+        return getattr(callback, '_executor', None), _args_for(callback, args)
+
+    def _call(self, callback, args=(), kwargs={}, direct=False, limit=None, signal=None):
+        """
+        Calls a callback with optional args and keyword args lists. If `limit' is the
+        signal or pattern whose call limit the callback is under, one of its remaining
+        calls is claimed first, and the callback isn't called if there are none left.
+        Callbacks bound to an executor by `_on` are submitted to it, and the resulting
+        future is returned. Unless `direct' is True, calls go through `_call_partial',
+        which wraps them in deferreds when Twisted is installed
+
+        :param signal: The signal being emitted, which errors of callbacks bound to an
+                       executor are reported for
+        """
+        # None implies no callback limit
+        if limit is not None and not self._claim(limit, callback, args, kwargs):
+            return None
+
+        args = _args_for(callback, args)
+        call = _call_direct if direct else _call_partial
+
+        executor = getattr(callback, '_executor', None)
+        if executor is not None:
+            return call(self._submit, executor, signal, callback, args, kwargs)
+
+        return call(callback, *args, **kwargs)
+
+    def _submit(self, executor, signal, callback, args, kwargs):
+        """
+        Submits a call of a callback to its executor. The emit is over by the time the
+        call fails, so its error is handled like the 'log' policy would, and counted
+        against the callback if the policy is a `CircuitBreaker'
+
+        :returns: The future of the call
+        """
+        future = executor.submit(callback, *args, **kwargs)
+        future.add_done_callback(lambda future: self._settled(signal, callback, future))
+        return future
+
+    def _settled(self, signal, callback, future):
+        """
+        Handles the error of a call submitted by `_submit', if it failed
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and not isinstance(error, StopPropagation):
+            self._recover(signal, callback, error)
+
+    def _claim(self, signal, callback, args=(), kwargs={}):
+        """
+        Claims a call of a callback with a call limit or a rate limit on a signal. The
+        rate limit may drop the call, or hold on to it to make later. Otherwise, one of
+        the remaining calls is claimed, and claiming the last call disconnects the
+        callback from that signal right away, so exhausted callbacks never linger in the
+        registry
+
+        :param signal: The signal or pattern the callback was registered to
+        :param callback: A callable registered with a call limit or a rate limit
+        :param args: The args the callback would be called with
+        :param kwargs: The kwargs the callback would be called with
+        :returns: True if the callback may be called now, False otherwise
+        """
+        with self._lock:
+            rate = self._rates.get((signal, callback))
+            if rate is not None and not rate.admit(self, signal, callback, args, kwargs):
+                return False
+            return self._spend(signal, callback)
+
+    def _spend(self, signal, callback):
+        """
+        Spends one of the remaining calls of a callback on a signal, if it has a call
+        limit there. Must be called with the lock held
+
+        :returns: True if the callback may be called, False otherwise
+        """
+        remaining = self._budgets.get((signal, callback))
+        if remaining is None:
+            # Exhausted by another emit since this one took its plan, unless the
+            # limit was lifted in the meantime
+            return ((signal, callback) in self._rates or
+                    self.responds_to(callback, signal))
+
+        if remaining > 1:
+            self._budgets[(signal, callback)] = remaining - 1
+            return True
+
+        self._remove_receiver(signal, callback)
+        return remaining == 1
+
+    def _fire(self, signal, callback, args, kwargs):
+        """
+        Makes a call held on to by the rate limit of a callback, from the timer thread.
+        There is no emit to raise errors to, so they are logged
+        """
+        with self._lock:
+            if not self._spend(signal, callback):
+                return
+        try:
+            self._call(callback, args, kwargs, direct=True, signal=signal)
+        except StopPropagation:
+            pass
+        except Exception as e:
+            self._recover(signal, callback, e)
+
+    def _add_receiver(self, signal, callback):
+        """
+        Publishes a new receiver tuple for a signal with callback inserted after every
+        callback of the same or higher priority, which keeps the tuple in call order. A
+        callback that is already registered is left where it is
+
+        :param signal: A signal the callback should respond to
+        :param callback: A callable that should respond to the signal
+        """
+        with self._lock:
+            if (signal, callback) in self._seqs:
+                return False
+            else:
+                current = self.receivers.get(signal, ())
+                priority = _priority(callback)
+                position = len(current)
+                while position and _priority(current[position - 1]) < priority:
+                    position -= 1
+                callbacks = current[:position] + (callback,) + current[position:]
+                self._seqs[(signal, callback)] = next(_sequence)
+                self._publish(signal, callbacks, callback)
+                self._index.setdefault(callback, set()).add(signal)
+                return True
+
+    def _remove_receiver(self, signal, callback):
+        """
+        Publishes a new receiver tuple for a signal with callback removed from it. Any emit
+        already iterating the previous tuple is unaffected
+
+        :param signal: A signal the callback responds to
+        :param callback: A callable registered with smokesignal
+        """
+        with self._lock:
+            if (signal, callback) in self._seqs:
+                current = self.receivers[signal]
+                position = current.index(callback)
+                self._publish(signal, current[:position] + current[position + 1:], callback)
+                self._unindex(callback, signal)
+
+    def _unindex(self, callback, signal):
+        """
+        Removes a signal from the reverse index entry of a callback, dropping the entry
+        once the callback responds to nothing
+
+        :param callback: A callable registered with smokesignal
+        :param signal: A signal the callback no longer responds to
+        """
+        self._budgets.pop((signal, callback), None)
+        self._filters.pop((signal, callback), None)
+        self._seqs.pop((signal, callback), None)
+        rate = self._rates.pop((signal, callback), None)
+        if rate is not None:
+            rate.cancel()
+        registered = self._index.get(callback)
+        if registered is not None:
+            registered.discard(signal)
+            if not registered:
+                del self._index[callback]
+
+    def _publish(self, signal, callbacks, changed=None):
+        """
+        Replaces the receiver tuple for a signal and compiles its dispatch plan. Most
+        callbacks are called directly by `emit', while callbacks that need more than a
+        plain call are routed through `_call'. Publishing an empty tuple prunes the signal
+        from the registry entirely
+
+        :param signal: A signal to publish receivers for
+        :param callbacks: A tuple of callables that respond to the signal
+        :param changed: The only callback added to or removed from the signal, if the
+                        plan can be patched for it rather than compiled again
+        """
+        if callbacks:
+            self.receivers[signal] = callbacks
+        else:
+            self.receivers.pop(signal, None)
+
+        if not _is_pattern(signal):
+            self._matches.pop(signal, None)
+            plan = None
+            if changed is not None:
+                plan = self._patch(signal, callbacks, changed)
+            if plan is None:
+                self._store_plan(signal)
+            else:
+                self._set_plan(signal, plan)
+            return
+
+        # A pattern may change the plan of any signal it matches
+        self._patterns.set(signal, bool(callbacks))
+        self._recompile(signal)
+
+    def _recompile(self, pattern=None):
+        """
+        Recompiles dispatch plans, including those of bound signals, and forgets all
+        memoized pattern plans
+
+        :param pattern: Only recompile the plans of signals this pattern matches. None
+                        to recompile every plan
+        """
+        self._matches.clear()
+        names = set(self._plans).union(self._signals.keys())
+        if pattern is not None:
+            trie = _PatternTrie()
+            trie.set(pattern, True)
+            names = [name for name in names if isinstance(name, str) and trie.match(name)]
+        for name in names:
+            self._store_plan(name)
+
+    def _store_plan(self, signal):
+        """
+        Compiles and stores the dispatch plan of a signal, or drops it if the signal has
+        no callbacks left. A bound `Signal' is handed its new plan as well
+        """
+        self._set_plan(signal, self._compile(signal))
+
+    def _set_plan(self, signal, plan):
+        """
+        Stores the dispatch plan of a signal, or drops it if it is `_no_plan' or None,
+        and hands it to the signal's bound `Signal'
+        """
+        if plan is None or not plan[0]:
+            self._plans.pop(signal, None)
+            plan = _no_plan
+        else:
+            self._plans[signal] = plan
+
+        bound = self._signals.get(signal)
+        if bound is not None:
+            bound._plan = plan
+
+    def _patch(self, signal, callbacks, changed):
+        """
+        Returns the dispatch plan of a signal after a single callback was added to or
+        removed from its receivers, derived from its current plan rather than compiled.
+        Only plans that are simply the signal's receivers can be patched, so this returns
+        None when patterns match the signal or hooks are installed, as well as for the
+        first filtered callback of a plan
+
+        :param signal: A signal that isn't a pattern
+        :param callbacks: The new receiver tuple of the signal
+        :param changed: The callback that was added or removed
+        """
+        if _hooks or self._patterns and isinstance(signal, str) and self._patterns.match(signal):
+            return None
+
+        key = (signal, changed)
+        old_callbacks, routed, filters = self._plans.get(signal, _no_plan)
+        match = self._filters.get(key)
+        if filters is None and match is not None:
+            return None
+        if not callbacks:
+            return _no_plan
+
+        # Besides the callbacks, the plan only changes in whether the callback is
+        # routed and in its filter
+        added = len(callbacks) > len(old_callbacks)
+        if not added:
+            if routed is not None and changed in routed:
+                routed = dict(routed)
+                del routed[changed]
+        elif key in self._budgets or key in self._rates:
+            routed = dict(routed or ())
+            routed[changed] = signal
+        elif _routed(changed):
+            routed = dict(routed or ())
+            routed[changed] = None
+
+        if filters is not None:
+            filters = filters.changed(self._order(signal, changed), changed, match, added)
+        return (callbacks, routed or None, filters)
+
+    def _compile(self, signal):
+        """
+        Compiles the dispatch plan of a signal from its own callbacks and those of every
+        pattern that matches it, in order of priority and then of registration. A callback
+        is only called once per emit, however many of these it is registered with
+
+        :param signal: A signal to compile a plan for
+        :returns: A dispatch plan, or None if nothing responds to the signal
+        """
+        callbacks = self.receivers.get(signal, ())
+        registrations = dict.fromkeys(callbacks, signal)
+
+        if self._patterns and isinstance(signal, str):
+            # A callback registered to several matching patterns is called for the one
+            # it was registered to first, unless it is registered to the signal itself
+            seqs = self._seqs
+            for pattern in self._patterns.match(signal):
+                for callback in self.receivers[pattern]:
+                    registered = registrations.get(callback)
+                    if registered is None or (registered != signal and
+                                              seqs[(pattern, callback)] <
+                                              seqs[(registered, callback)]):
+                        registrations[callback] = pattern
+            callbacks = tuple(sorted(registrations,
+                                     key=lambda c: self._order(registrations[c], c)))
+
+        if not callbacks:
+            return None
+
+        # Each routed callback is mapped to the signal or pattern it counts its calls
+        # against, which is the signal itself if it was registered to both. Filters
+        # come from the same registration
+        routed = {}
+        matches = []
+        for callback in callbacks:
+            registration = registrations[callback]
+            key = (registration, callback)
+            if key in self._budgets or key in self._rates:
+                routed[callback] = registration
+            elif _routed(callback):
+                routed[callback] = None
+            matches.append(self._filters.get(key))
+
+        # Instrumentation is compiled into the plan, so it costs nothing when disabled
+        plan_callbacks = callbacks
+        if _hooks:
+            plan_callbacks = tuple(_Instrumented(signal, c) for c in callbacks)
+
+        filters = None
+        if any(match is not None for match in matches):
+            filters = _Filters([(self._order(registrations[c], c), p, match) for c, p, match
+                                in zip(callbacks, plan_callbacks, matches)])
+        return (plan_callbacks, routed or None, filters)
+
+    def _ordered(self, signal, callbacks):
+        """
+        Returns a tuple of the callbacks of a signal or pattern sorted into call order,
+        from highest to lowest priority and then in the order they were registered
+        """
+        return tuple(sorted(callbacks, key=lambda c: self._order(signal, c)))
+
+    def _order(self, signal, callback):
+        """
+        Returns the key that sorts a callback registered to a signal or pattern into
+        call order, which is unique to the registration
+        """
+        return (-_priority(callback), self._seqs[(signal, callback)])
+
+    def _resolve(self, signal):
+        """
+        Returns the dispatch plan of a signal without callbacks of its own, which can only
+        receive through signal patterns. Plans are memoized per signal until the patterns
+        change
+
+        :param signal: A signal being emitted
+        """
+        if not self._patterns:
+            return _no_plan
+
+        plan = self._matches.get(signal)
+        if plan is None:
+            with self._lock:
+                if len(self._matches) >= _matches_limit:
+                    self._matches.clear()
+                plan = self._matches[signal] = self._compile(signal) or _no_plan
+        return plan
+
+
+class Signal(object):
     """
-    Context manager for emitting signals either on enter or on exit of a context.
-    By default, if this context manager is created using a single arg-style argument,
-    it will emit a signal on exit. Otherwise, keyword arguments indicate signal points
+    A signal bound to a dispatcher by `Dispatcher.signal'. The dispatcher hands a bound
+    signal its dispatch plan whenever it changes, so emitting one skips looking the
+    signal up::
+
+        saved = smokesignal.signal('saved')
+        saved.on(my_callback)
+        saved.emit(obj)
     """
-    if enter is not None:
-        emit(enter)
+    __slots__ = ('name', 'dispatcher', '_plan', '__weakref__')
 
-    try:
-        yield
-    finally:
-        emit(exit)
+    def __init__(self, name, dispatcher):
+        self.name = name
+        self.dispatcher = dispatcher
+        self._plan = _no_plan
 
+    def __repr__(self):
+        return '<Signal %r>' % (self.name,)
 
-def _call(callback, args=[], kwargs={}):
+    @property
+    def receivers(self):
+        """
+        The tuple of callbacks registered to respond to this signal itself
+        """
+        return self.dispatcher.receivers.get(self.name, ())
+
+    def emit(self, *args, **kwargs):
+        """
+        Emits the signal, calling its callbacks with optional args and kwargs. See
+        `Dispatcher.emit'
+        """
+        callbacks, routed = _selected(self._plan, kwargs)
+        dispatcher = self.dispatcher
+
+        # After a failure, the loop resumes from the callback after the failed one
+        remaining = iter(callbacks)
+        failures = None
+        while True:
+            try:
+                if routed is None:
+                    for callback in remaining:
+                        callback(*args, **kwargs)
+                else:
+                    for callback in remaining:
+                        if callback in routed:
+                            dispatcher._call(callback, args, kwargs, limit=routed[callback],
+                                             signal=self.name)
+                        else:
+                            callback(*args, **kwargs)
+                break
+            except StopPropagation:
+                break
+            except Exception as e:
+                if dispatcher.error_policy == 'raise':
+                    raise
+                failures = dispatcher._failed(self.name, callback, e, failures)
+
+        if failures:
+            raise EmitError(failures)
+
+    _emit_sync = emit
+
+    def emit_lazy(self, factory, **kwargs):
+        """
+        Emits the signal with a payload that is only built if something responds to it.
+        See `Dispatcher.emit_lazy'
+        """
+        if not _selected(self._plan, kwargs)[0]:
+            return self.dispatcher._unheard()
+        return self.emit(factory(), **kwargs)
+
+    def has_receivers(self, **kwargs):
+        """
+        Returns True if any callback would be called by emitting the signal with
+        optional kwargs. See `Dispatcher.has_receivers'
+        """
+        return bool(_selected(self._plan, kwargs)[0])
+
+    def _relay(self, *args, **kwargs):
+        """
+        Emits the signal through its dispatcher, in place of `emit' unless the dispatcher
+        emits with the sync backend
+        """
+        return self.dispatcher.emit(self.name, *args, **kwargs)
+
+    def on(self, callback=None, **kwargs):
+        """
+        Registers a callback for this signal. Accepts the same keyword arguments as
+        `Dispatcher.on', and works as both a function and a decorator
+        """
+        return self.dispatcher.on(self.name, callback, **kwargs)
+
+    def once(self, callback=None, **kwargs):
+        """
+        Registers a callback that will respond to this signal at most one time
+        """
+        return self.dispatcher.once(self.name, callback, **kwargs)
+
+    def disconnect(self, callback):
+        """
+        Stops a callback from responding to this signal
+        """
+        self.dispatcher.disconnect_from(callback, self.name)
+
+    def clear(self):
+        """
+        Clears all callbacks for this signal
+        """
+        self.dispatcher.clear(self.name)
+
+
+class BufferedSignal(object):
     """
-    Calls a callback with optional args and keyword args lists. This method exists so
-    we can inspect the `_max_calls` attribute that's set by `_on`. If this value is None,
-    the callback is considered to have no limit. Otherwise, an integer value is expected
-    and decremented until there are no remaining calls
+    Buffers emissions of a signal and sends them on to its callbacks together, once
+    `size' emissions are buffered or `interval' seconds after the first one, whichever
+    comes first. A strategy decides which buffered emissions are sent:
+
+    - 'all' sends every emission, in order
+    - 'last' sends only the most recent emission
+    - 'key' sends the most recent emission for each value of `key(*args, **kwargs)'
+
+    Buffered signals can be used as context managers, which flush on exit::
+
+        with smokesignal.BufferedSignal('tick', strategy='last', interval=1) as tick:
+            tick.emit(n)
+
+    :param signal: Signal to send
+    :param size: Number of emissions to buffer before flushing. None for no limit.
+    :param interval: Seconds to wait after an emission before flushing. None to wait
+                     for `size' emissions or an explicit `flush'.
+    :param strategy: One of 'all', 'last' or 'key'
+    :param key: A callable returning the key of an emission for the 'key' strategy
+    :param dispatcher: The `Dispatcher' to emit through. None for the default one
     """
-    if not hasattr(callback, '_max_calls'):
-        callback._max_calls = None
+    strategies = ('all', 'last', 'key')
+
+    def __init__(self, signal, size=None, interval=None, strategy='all', key=None,
+                 dispatcher=None):
+        if strategy not in self.strategies:
+            raise ValueError('Unknown buffer strategy: %r' % (strategy,))
+        if strategy == 'key' and not callable(key):
+            raise ValueError('The key strategy requires a callable key')
+
+        self.signal = signal
+        self.size = size
+        self.interval = interval
+        self.strategy = strategy
+        self.key = key
+        self.dispatcher = dispatcher
+
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._count = 0
+        self._timer = None
+
+        _buffers.add(self)
+
+    def __len__(self):
+        """
+        Returns the number of emissions that would be sent by a flush
+        """
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def emit(self, *args, **kwargs):
+        """
+        Buffers an emission of the signal. Accepts the same args and kwargs as `emit'
+        """
+        with self._lock:
+            if self.strategy == 'all':
+                key = self._count
+            elif self.strategy == 'last':
+                key = None
+            else:
+                key = self.key(*args, **kwargs)
+
+            # Replacing a key keeps its position, so deduplicated emissions are sent in
+            # the order they were first buffered
+            self._pending[key] = (args, kwargs)
+            self._count += 1
+
+            full = self.size is not None and self._count >= self.size
+            if not full and self.interval is not None and self._timer is None:
+                self._timer = _timers.call_later(self.interval, self.flush)
+
+        if full:
+            self.flush()
 
-    # None implies no callback limit
-    if callback._max_calls is None:
-        return _call_partial(callback, *args, **kwargs)
+    def flush(self):
+        """
+        Sends all buffered emissions to the signal's callbacks. They are always emitted
+        synchronously, since flushes on an interval run on the timer thread
 
-    # Should the signal be disconnected?
-    if callback._max_calls <= 0:
-        return disconnect(callback)
+        :returns: The number of emissions sent
+        """
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            self._count = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
 
-    callback._max_calls -= 1
+        dispatcher = self.dispatcher or _default
+        for args, kwargs in pending.values():
+            dispatcher._emit_sync(self.signal, *args, **kwargs)
 
-    return _call_partial(callback, *args, **kwargs)
+        return len(pending)
 
 
-def signals(callback):
+def flush_all():
     """
-    Returns a tuple of all signals for a particular callback
+    Flushes every buffered signal
+    """
+    for buffered in list(_buffers):
+        buffered.flush()
+
 
-    :param callback: A callable registered with smokesignal
-    :returns: Tuple of all signals callback responds to
+class CircuitBreaker(object):
     """
-    return tuple(s for s in receivers if responds_to(callback, s))
+    Error policy that logs errors raised by callbacks and carries on, like 'log', but
+    disconnects a callback from every signal of a dispatcher once it fails `failures'
+    times within `window' seconds there. A breaker shared by several dispatchers counts
+    failures separately for each of them::
 
+        smokesignal.set_error_policy(smokesignal.CircuitBreaker(failures=5, window=60))
 
-def responds_to(callback, signal):
+    :param failures: The number of failures that disconnect a callback
+    :param window: The number of seconds failures are counted over
     """
-    Returns bool if callback will respond to a particular signal
+    def __init__(self, failures=5, window=60.0):
+        if failures < 1:
+            raise ValueError('failures must be at least 1')
+        self.failures = failures
+        self.window = window
+        self._lock = threading.Lock()
+        self._recent = {}
+
+    def failed(self, dispatcher, callback):
+        """
+        Counts a failure of a callback on a dispatcher, disconnecting it from the
+        dispatcher if it has failed there too often
+
+        :returns: True if the callback was disconnected
+        """
+        now = _clock()
+        with self._lock:
+            # Callbacks that haven't failed within the window are forgotten, so failures
+            # don't keep them or their dispatchers alive
+            for stale in [key for key, times in self._recent.items()
+                          if now - times[-1] > self.window]:
+                del self._recent[stale]
+
+            # Only the latest failures matter, so each callback keeps a bounded deque
+            key = (dispatcher, callback)
+            recent = self._recent.get(key)
+            if recent is None:
+                recent = self._recent[key] = deque(maxlen=self.failures)
+            recent.append(now)
+            tripped = len(recent) == self.failures and now - recent[0] <= self.window
+            if tripped:
+                del self._recent[key]
+
+        if tripped:
+            _log.warning('Disconnecting callback %r after %d failures',
+                         callback, self.failures)
+            dispatcher.disconnect(callback)
+        return tripped
+
 
-    :param callback: A callable registered with smokesignal
-    :param signal: A signal to check if callback responds
-    :returns: True if callback responds to signal, False otherwise
+class BackgroundDispatcher(object):
     """
-    return callback in receivers[signal]
+    Emits signals from worker threads, so emitting only has to put the emission on a
+    bounded queue. Callbacks are called by the workers exactly as the 'sync' backend's
+    `emit' would call them, call limits included. When the queue is full, a policy
+    decides what happens to a new emission:
 
+    - 'block' waits for a worker to make room
+    - 'drop_newest' drops the new emission
+    - 'drop_oldest' drops the emission that has been queued longest
+    - 'inline' emits it in the emitting thread instead
 
-def on(signals, callback=None, max_calls=None):
+    Call `drain' to wait for queued emissions to be sent, and `close' when done::
+
+        background = smokesignal.BackgroundDispatcher(maxsize=1000, policy='drop_oldest')
+        background.emit('request_finished', request)
+        ...
+        background.close(timeout=5)
+
+    :param dispatcher: The `Dispatcher' to emit through. None for the default one
+    :param maxsize: The number of emissions the queue holds before the policy applies
+    :param workers: The number of worker threads
+    :param policy: One of 'block', 'drop_newest', 'drop_oldest' or 'inline'
     """
-    Registers a single callback for receiving an event (or event list). Optionally,
-    can specify a maximum number of times the callback should receive a signal. This
-    method works as both a function and a decorator::
+    policies = ('block', 'drop_newest', 'drop_oldest', 'inline')
+
+    def __init__(self, dispatcher=None, maxsize=1000, workers=1, policy='block'):
+        if policy not in self.policies:
+            raise ValueError('Unknown backpressure policy: %r' % (policy,))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.dispatcher = dispatcher
+        self.maxsize = maxsize
+        self.policy = policy
+
+        # Counters, read them at will
+        self.emitted = 0
+        self.dropped = 0
+        self.inline = 0
+        self.errors = 0
+        self.max_depth = 0
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._unfinished = 0
+        self._closed = False
+
+        self._workers = []
+        for x in range(workers):
+            worker = threading.Thread(target=self._work, name='smokesignal-worker-%d' % x)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def __len__(self):
+        """
+        Returns the number of emissions waiting in the queue
+        """
+        return len(self._queue)
+
+    depth = property(__len__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def emit(self, signal, *args, **kwargs):
+        """
+        Queues an emission of a signal. Accepts the same args and kwargs as `emit'
+
+        :param signal: Signal to send
+        :returns: False if the emission was dropped, True otherwise
+        """
+        inline = False
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BackgroundDispatcher is closed')
+
+            if len(self._queue) >= self.maxsize:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                elif self.policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self._unfinished -= 1
+                    self.dropped += 1
+                elif self.policy == 'inline':
+                    self.inline += 1
+                    inline = True
+                else:
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        raise RuntimeError('BackgroundDispatcher is closed')
+
+            if not inline:
+                self._queue.append((signal, args, kwargs))
+                self._unfinished += 1
+                self.max_depth = max(self.max_depth, len(self._queue))
+                self._cond.notify_all()
+
+        if inline:
+            (self.dispatcher or _default).emit(signal, *args, **kwargs)
+        return True
+
+    def drain(self, timeout=None):
+        """
+        Waits until every queued emission has been sent
+
+        :param timeout: Seconds to wait at most. None to wait as long as it takes
+        :returns: True if the queue was drained, False if the timeout ran out first
+        """
+        deadline = None if timeout is None else _clock() + timeout
+        with self._cond:
+            while self._unfinished:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Drains the queue, then stops the workers. Emissions still queued when the
+        timeout runs out are never sent
+
+        :param timeout: Seconds to wait at most. None to wait as long as it takes
+        :returns: True if the queue was drained, False if the timeout ran out first
+        """
+        drained = self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._unfinished -= len(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
+        return drained
+
+    def _work(self):
+        dispatcher = self.dispatcher or _default
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                signal, args, kwargs = self._queue.popleft()
+                self._cond.notify_all()
+
+            # Workers always emit synchronously, whatever the backend, since they don't
+            # run an event loop or reactor
+            try:
+                dispatcher._emit_sync(signal, *args, **kwargs)
+            except Exception:
+                _log.exception('Signal %r failed in a background worker', signal)
+                failed = True
+            else:
+                failed = False
+
+            with self._cond:
+                self._unfinished -= 1
+                self.emitted += 1
+                self.errors += failed
+                self._cond.notify_all()
+
+
+class ProcessBus(object):
+    """
+    Relays signals between local processes over Unix domain sockets, so a pre-fork
+    worker pool can broadcast signals to its siblings without a message broker. Every
+    process creates a bus on the same directory, where each binds a socket of its own::
+
+        bus = smokesignal.ProcessBus('/run/myapp/signals', ['cache.invalidate'])
+        smokesignal.emit('cache.invalidate', 'user:1')  # also emitted in every sibling
+
+    Emitting one of the bus's signals in a process publishes the emission to every
+    other process on the bus. Received emissions are emitted through the dispatcher by
+    a receiving thread, but aren't published again. Emissions are published by a
+    sending thread, which packs whatever is waiting into as few datagrams as it can.
+    Each emission is framed by the lengths of its signal name and of its pickled args
+    and kwargs, so args must be picklable.
+
+    Create buses after forking, since threads and sockets aren't shared with forked
+    children. Received emissions are unpickled, so the directory is created readable
+    only by its owner, and an existing one must be owned by this user and not writable
+    by its group or others. Call `close' when done.
+
+    :param path: The directory of the bus's sockets
+    :param signals: A list of signal names to publish. Patterns aren't supported
+    :param dispatcher: The `Dispatcher' to publish from and emit through. None for the
+                       default one
+    :param name: The name of this process's socket in the directory, its pid by default
+    :param timeout: Seconds to wait for a busy process to read before dropping a datagram
+    """
+    def __init__(self, path, signals, dispatcher=None, name=None, timeout=1.0):
+        import pickle
+        import socket
+
+        if isinstance(signals, str):
+            signals = [signals]
+        for signal in signals:
+            if not isinstance(signal, str) or _is_pattern(signal):
+                raise ValueError('ProcessBus signals must be names, not %r' % (signal,))
+
+        self.path = path
+        self.signals = tuple(signals)
+        self.dispatcher = dispatcher or _default
+        self.address = os.path.join(path, '%s.sock' % (name or os.getpid()))
+
+        # Counters, read them at will
+        self.published = 0
+        self.received = 0
+        self.errors = 0
 
-        smokesignal.on('foo', my_callback)
+        self._dumps = partial(pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL)
+        self._loads = pickle.loads
+        self._pending = []
+        self._unsent = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._relaying = threading.local()
 
-        @smokesignal.on('foo')
-        def my_callback():
+        try:
+            os.makedirs(path, 0o700)
+        except EnvironmentError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Anyone who can write to the directory can have this process unpickle anything
+        stat = os.stat(path)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise ValueError('ProcessBus directory %r must be owned by this user and not '
+                             'writable by its group or others' % (path,))
+        self._unlink(self.address)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.address)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.settimeout(timeout)
+
+        self._threads = []
+        for target in (self._receive, self._send):
+            thread = threading.Thread(target=target, name='smokesignal-bus')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        self._forwarders = [partial(self._forward, signal) for signal in self.signals]
+        for signal, forwarder in zip(self.signals, self._forwarders):
+            self.dispatcher.on(signal, forwarder)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def publish(self, signal, *args, **kwargs):
+        """
+        Publishes an emission of a signal to every other process on the bus, without
+        emitting it in this one. Accepts the same args and kwargs as `emit'
+
+        :param signal: The name of the signal to publish
+        """
+        name = signal.encode('utf-8')
+        payload = self._dumps((args, kwargs))
+        frame = _bus_frame.pack(len(name), len(payload)) + name + payload
+        if len(frame) > _bus_datagram_limit:
+            raise ValueError('Emission of %r is too large to publish' % (signal,))
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('ProcessBus is closed')
+            self._pending.append(frame)
+            self._unsent += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every published emission has been sent
+
+        :param timeout: Seconds to wait at most. None to wait as long as it takes
+        :returns: True if everything was sent, False if the timeout ran out first
+        """
+        deadline = None if timeout is None else _clock() + timeout
+        with self._cond:
+            while self._unsent:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Sends whatever has been published, then stops publishing and receiving and
+        removes this process's socket
+
+        :param timeout: Seconds to wait at most. None to wait as long as it takes
+        :returns: True if everything was sent, False if the timeout ran out first
+        """
+        for signal, forwarder in zip(self.signals, self._forwarders):
+            self.dispatcher.disconnect_from(forwarder, signal)
+
+        flushed = self.flush(timeout)
+        with self._cond:
+            if self._closed:
+                return flushed
+            self._closed = True
+            self._cond.notify_all()
+
+        # An empty datagram wakes the receiving thread up to notice it is closed
+        try:
+            self._sender.sendto(b'', self.address)
+        except EnvironmentError:
             pass
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+        self._sock.close()
+        self._sender.close()
+        self._unlink(self.address)
+        return flushed
+
+    def peers(self):
+        """
+        Returns the socket addresses of the other processes on the bus
+        """
+        return [os.path.join(self.path, entry) for entry in os.listdir(self.path)
+                if entry.endswith('.sock') and os.path.join(self.path, entry) != self.address]
+
+    def _forward(self, signal, *args, **kwargs):
+        # Emissions received from other processes aren't sent back to them
+        if getattr(self._relaying, 'signal', None) != signal:
+            self.publish(signal, *args, **kwargs)
+
+    def _send(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                frames, self._pending = self._pending, []
+
+            for datagram in _datagrams(frames):
+                for peer in self.peers():
+                    self._sendto(datagram, peer)
+
+            with self._cond:
+                self._unsent -= len(frames)
+                self.published += len(frames)
+                self._cond.notify_all()
+
+    def _sendto(self, datagram, peer):
+        try:
+            self._sender.sendto(datagram, peer)
+        except EnvironmentError as e:
+            # Nothing is listening on the socket of a process that has gone away
+            if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                self._unlink(peer)
+                return
+            with self._cond:
+                self.errors += 1
+            _log.warning('Dropped signals sent to %s: %s', peer, e)
+
+    def _receive(self):
+        while True:
+            try:
+                datagram = self._sock.recv(_bus_datagram_limit)
+            except EnvironmentError:
+                datagram = b''
+            if self._closed:
+                return
+
+            offset = 0
+            try:
+                while offset < len(datagram):
+                    name_size, payload_size = _bus_frame.unpack_from(datagram, offset)
+                    offset += _bus_frame.size
+                    signal = datagram[offset:offset + name_size].decode('utf-8')
+                    offset += name_size
+                    payload = datagram[offset:offset + payload_size]
+                    offset += payload_size
+                    self._relay(signal, payload)
+            except (struct.error, UnicodeDecodeError):
+                with self._cond:
+                    self.errors += 1
+                _log.warning('Dropped a malformed datagram sent to %s', self.address)
+
+    def _relay(self, signal, payload):
+        self._relaying.signal = signal
+        # The receiving thread has no event loop or reactor to emit through
+        try:
+            args, kwargs = self._loads(payload)
+            self.dispatcher._emit_sync(signal, *args, **kwargs)
+        except Exception:
+            _log.exception('Relaying signal %r received by %s failed', signal, self.address)
+            failed = True
+        else:
+            failed = False
+        finally:
+            self._relaying.signal = None
+
+        with self._cond:
+            self.received += 1
+            self.errors += failed
+
+    @staticmethod
+    def _unlink(address):
+        try:
+            os.unlink(address)
+        except EnvironmentError:
+            pass
+
+
+def _datagrams(frames):
+    """
+    Packs frames into as few datagrams as fit within `_bus_datagram_limit'
+    """
+    datagram = []
+    size = 0
+    for frame in frames:
+        if size + len(frame) > _bus_datagram_limit:
+            yield b''.join(datagram)
+            datagram = []
+            size = 0
+        datagram.append(frame)
+        size += len(frame)
+    if datagram:
+        yield b''.join(datagram)
+
+
+def first_non_none(results):
+    """
+    Reducer for `emit_reduce' returning the first result that isn't None, or None if
+    there is none. Callbacks after the one with the result aren't called
+    """
+    for result in results:
+        if result is not None:
+            return result
+    return None
+
+
+def _call_direct(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def _gathered(outcomes, results, pending, policy):
+    """
+    Fills the results of an emit with the Twisted backend in with the outcomes of the
+    deferreds returned by its callbacks. Under the 'group' error policy, raises an
+    `EmitError' if any of them failed
+
+    :param outcomes: The (success, value) pairs of a DeferredList
+    :param results: The list of callback results, in call order
+    :param pending: (index, callback, deferred) triples of the deferred results
+    :param policy: The error policy of the emitting dispatcher
+    """
+    failures = []
+    for (index, callback, d), (success, value) in zip(pending, outcomes):
+        results[index] = value
+        if not success:
+            failures.append((callback, value.value))
+
+    if failures and policy == 'group':
+        raise EmitError(failures)
+    return results
+
+
+def _selected(plan, kwargs):
+    """
+    Returns the callbacks of a dispatch plan that an emit with keyword arguments kwargs
+    calls, and the plan's dict of routed callbacks
+    """
+    callbacks, routed, filters = plan
+    if filters is not None:
+        callbacks = filters.select(kwargs)
+    return callbacks, routed
+
+
+def _args_for(callback, args):
+    """
+    Returns the positional arguments to call a callback with. Batch callbacks receive
+    all positional arguments as a single list of payloads
+    """
+    if getattr(callback, '_batch', False):
+        return (list(args),)
+    return args
+
+
+def _routed(callback):
+    """
+    Returns True if a callback has to be called through `_call' rather than directly
+    on every signal, because it is bound to an executor or receives batches
+    """
+    return (getattr(callback, '_executor', None) is not None or
+            getattr(callback, '_batch', False))
 
-    :param signals: A single signal or list/tuple of signals that callback should respond to
-    :param callback: A callable that should repond to supplied signal(s)
-    :param max_calls: Integer maximum calls for callback. None for no limit.
-    """
-    if isinstance(callback, int) or callback is None:
-        # Decorated
-        if isinstance(callback, int):
-            # Here the args were passed arg-style, not kwarg-style
-            callback, max_calls = max_calls, callback
-        return partial(_on, signals, max_calls=max_calls)
-    elif isinstance(callback, types.MethodType):
-        # callback is a bound instance method, so we need to wrap it in a function
-        def _callback(*args, **kwargs):
-            return callback(*args, **kwargs)
-        return _on(signals, _callback, max_calls=max_calls)
-    else:
-        # Function call
-        return _on(signals, callback, max_calls=max_calls)
 
+def _identity(callback):
+    """
+    Returns a key identifying the callable a callback stands for. Bound methods are
+    identified by their instance and function, since a new method object is created
+    each time one is looked up on an instance
+    """
+    if isinstance(callback, _Receiver):
+        return callback._key
+    if isinstance(callback, types.MethodType):
+        return (id(callback.__self__), id(callback.__func__))
+    return id(callback)
+
+
+class _Receiver(object):
+    """
+    Base for objects registered in place of a callback. A receiver hashes and compares
+    equal to the callback it stands for, so the callback itself can be passed to
+    `responds_to', `disconnect' and friends
+    """
+    _executor = None
+    _batch = False
+    _priority = 0
+
+    def __init__(self, callback):
+        self._key = _identity(callback)
+        self._hash = hash(callback)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self._key == _identity(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class _BoundReceiver(_Receiver):
+    """
+    Holds a strong reference to a bound method
+    """
+    def __init__(self, method):
+        super(_BoundReceiver, self).__init__(method)
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        return self.method(*args, **kwargs)
+
+
+class _WeakReceiver(_Receiver):
+    """
+    Holds a weak reference to a callback, or to the instance of a bound method. The
+    receiver disconnects itself as soon as its referent is garbage collected, or at
+    the latest the next time it is called after that
+    """
+    def __init__(self, callback, dispatcher):
+        super(_WeakReceiver, self).__init__(callback)
+        self.dispatcher = dispatcher
+        if isinstance(callback, types.MethodType):
+            self._ref = weakref.ref(callback.__self__, self._reap)
+            self._func = callback.__func__
+        else:
+            self._ref = weakref.ref(callback, self._reap)
+            self._func = None
+
+    def __call__(self, *args, **kwargs):
+        target = self._ref()
+        if target is None:
+            return self._reap()
+        if self._func is None:
+            return target(*args, **kwargs)
+        return self._func(target, *args, **kwargs)
+
+    def __eq__(self, other):
+        # A dead receiver only matches receivers, so a recycled id can't match it
+        if not isinstance(other, _Receiver) and self._ref() is None:
+            return False
+        return super(_WeakReceiver, self).__eq__(other)
+
+    __hash__ = _Receiver.__hash__
+
+    def _reap(self, ref=None):
+        self.dispatcher.disconnect(self)
+
+
+class _Instrumented(_Receiver):
+    """
+    Wraps a callback in a compiled plan to report each of its calls to the dispatch
+    hooks. Executors and other options are read from the callback
+    """
+    def __init__(self, signal, callback):
+        super(_Instrumented, self).__init__(callback)
+        self.signal = signal
+        self.callback = callback
+
+    def __call__(self, *args, **kwargs):
+        hooks = _hooks
+        for hook in hooks:
+            hook.pre_dispatch(self.signal, self.callback, args, kwargs)
+
+        error = None
+        start = _clock()
+        try:
+            return self.callback(*args, **kwargs)
+        except StopPropagation:
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = _clock() - start
+            for hook in hooks:
+                hook.post_dispatch(self.signal, self.callback, elapsed, error)
+
+    def __reduce__(self):
+        # Hooks belong to this process, so a callback sent to a process pool is sent
+        # along with the signal it answers to and reports to that process's hooks
+        return (_Instrumented, (self.signal, self.callback))
+
+    _executor = property(lambda self: getattr(self.callback, '_executor', None))
+    _batch = property(lambda self: getattr(self.callback, '_batch', False))
+    _priority = property(lambda self: _priority(self.callback))
+
+
+class Hook(object):
+    """
+    Base class for dispatch hooks, which are told about every call of every callback
+    while they are added with `add_hook'. Subclasses override whichever of the methods
+    they need
+    """
+    def pre_dispatch(self, signal, callback, args, kwargs):
+        """
+        Called before callback is called for an emitted signal
+        """
+
+    def post_dispatch(self, signal, callback, elapsed, error):
+        """
+        Called after callback returns or raises. `elapsed' is the time taken by the
+        call in seconds and `error' is the exception it raised, or None. For callbacks
+        returning an awaitable or running on an executor, only the synchronous part of
+        the call is timed
+        """
+
+
+class Stats(Hook):
+    """
+    Dispatch hook counting the calls, errors and latency of each callback of each
+    signal. Latencies are kept in a histogram of power of two microsecond buckets,
+    so percentiles are accurate to within a factor of two
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def post_dispatch(self, signal, callback, elapsed, error):
+        bucket = max(0, math.frexp(elapsed * 1e6)[1])
+        with self._lock:
+            entry = self._stats.get((signal, callback))
+            if entry is None:
+                entry = self._stats[(signal, callback)] = [0, 0, 0.0, {}]
+            entry[0] += 1
+            entry[1] += error is not None
+            entry[2] += elapsed
+            entry[3][bucket] = entry[3].get(bucket, 0) + 1
+
+    def reset(self):
+        """
+        Forgets everything recorded so far
+        """
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """
+        Returns a dict mapping each (signal, callback) pair to a dict of its `calls',
+        `errors', `total' and `mean' seconds, and `p50' and `p99' latency in seconds
+        """
+        with self._lock:
+            entries = [(key, calls, errors, total, dict(histogram))
+                       for key, (calls, errors, total, histogram) in self._stats.items()]
+
+        return dict((key, {
+            'calls': calls,
+            'errors': errors,
+            'total': total,
+            'mean': total / calls,
+            'p50': self._percentile(histogram, calls, 0.50),
+            'p99': self._percentile(histogram, calls, 0.99),
+        }) for key, calls, errors, total, histogram in entries)
+
+    @staticmethod
+    def _percentile(histogram, calls, fraction):
+        """
+        Returns the upper bound in seconds of the bucket holding a percentile
+        """
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= fraction * calls:
+                return (2 ** bucket) / 1e6
+        return 0.0
+
+
+def add_hook(hook):
+    """
+    Adds a dispatch hook to be told about every callback call. See `Hook'
+
+    :param hook: A `Hook' instance
+    """
+    global _hooks
+    with _lock:
+        if hook not in _hooks:
+            _hooks = _hooks + (hook,)
+            _recompile_all()
+
+
+def remove_hook(hook):
+    """
+    Removes a dispatch hook. Once no hooks are left, callbacks are called without any
+    instrumentation again
+
+    :param hook: A `Hook' instance added with `add_hook'
+    """
+    global _hooks
+    with _lock:
+        if hook in _hooks:
+            _hooks = tuple(h for h in _hooks if h is not hook)
+            _recompile_all()
+
+
+def _recompile_all():
+    """
+    Recompiles the dispatch plans of every dispatcher
+    """
+    for dispatcher in list(_dispatchers):
+        with dispatcher._lock:
+            dispatcher._recompile()
 
-def _on(on_signals, callback, max_calls=None):
+
+def instrument(enabled=True):
     """
-    Proxy for `smokesignal.on`, which is compatible as both a function call and
-    a decorator. This method cannot be used as a decorator
+    Starts or stops collecting call counts, errors and latency for every callback of
+    every signal. See `stats'
 
-    :param signals: A single signal or list/tuple of signals that callback should respond to
-    :param callback: A callable that should repond to supplied signal(s)
-    :param max_calls: Integer maximum calls for callback. None for no limit.
+    :param enabled: False to stop collecting and discard what was collected
+    :returns: The `Stats' hook collecting, or None when disabled
     """
-    if not callable(callback):
-        raise AssertionError('Signal callbacks must be callable')
+    global _stats
+    with _lock:
+        if enabled and _stats is None:
+            _stats = Stats()
+            add_hook(_stats)
+        elif not enabled and _stats is not None:
+            remove_hook(_stats)
+            _stats = None
+    return _stats
 
-    # Support for lists of signals
-    if not isinstance(on_signals, (list, tuple)):
-        on_signals = [on_signals]
 
-    callback._max_calls = max_calls
+def stats():
+    """
+    Returns the statistics collected since `instrument' was called, as a dict mapping
+    each (signal, callback) pair to a dict of `calls', `errors', `total', `mean', `p50'
+    and `p99'. Times are in seconds
 
-    # Register the callback
-    for signal in on_signals:
-        receivers[signal].add(callback)
+    :returns: A dict of statistics, empty if `instrument' hasn't been called
+    """
+    current = _stats
+    if current is None:
+        return {}
+    return current.snapshot()
 
-    # Setup responds_to partial for use later
-    if not hasattr(callback, 'responds_to'):
-        callback.responds_to = partial(responds_to, callback)
 
-    # Setup signals partial for use later.
-    if not hasattr(callback, 'signals'):
-        callback.signals = partial(signals, callback)
+def _priority(callback):
+    """
+    Returns the priority of a callback, which is 0 unless set by `_on'
+    """
+    return getattr(callback, '_priority', 0)
 
-    # Setup disconnect partial for user later
-    if not hasattr(callback, 'disconnect'):
-        callback.disconnect = partial(disconnect, callback)
 
-    # Setup disconnect_from partial for user later
-    if not hasattr(callback, 'disconnect_from'):
-        callback.disconnect_from = partial(disconnect_from, callback)
 
-    return callback
+def _is_pattern(signal):
+    """
+    Returns True if a signal is a pattern, with a '*' or '#' segment
+    """
+    if not isinstance(signal, str):
+        return False
+    return any(segment in ('*', '#') for segment in signal.split('.'))
 
 
-def once(signals, callback=None):
+class _Filters(object):
     """
-    Registers a callback that will respond to an event at most one time
+    Selects the callbacks of a dispatch plan that an emit calls, from the keyword
+    arguments it is emitted with. Callbacks filtered by a dict are indexed by the values
+    of its keys, so an emit only looks up the callbacks its values match, however many
+    there are. Callbacks filtered by a predicate have it called on every emit.
 
-    :param signals: A single signal or list/tuple of signals that callback should respond to
-    :param callback: A callable that should repond to supplied signal(s)
+    Each callback comes with its place in the call order, a key that sorts like the
+    plan and that no other callback of the plan shares. Filters are immutable, like
+    plans: `changed' returns new filters for a plan with one callback added or removed
+
+    :param entries: A (order, callback, match) triple for each callback of a plan, in
+                    call order, where match is a dict, a predicate or None
     """
-    return on(signals, callback, max_calls=1)
+    __slots__ = ('always', 'buckets', 'predicates', '_always')
+
+    def __init__(self, entries=()):
+        always = []
+        self.buckets = {}
+        self.predicates = []
+        for order, callback, match in entries:
+            if match is None:
+                always.append((order, callback))
+            elif isinstance(match, dict):
+                keys, values = _match_key(match)
+                bucket = self.buckets.setdefault(keys, {})
+                bucket.setdefault(values, []).append((order, callback))
+            else:
+                self.predicates.append((order, callback, match))
+
+        # Callbacks without filters, called when nothing else matches
+        self.always = tuple(callback for order, callback in always)
+        self._always = always
+
+    def select(self, kwargs):
+        """
+        Returns the callbacks to call for an emit with keyword arguments kwargs, in
+        call order
+        """
+        selected = None
+        for keys, bucket in self.buckets.items():
+            try:
+                values = tuple([kwargs[key] for key in keys])
+                matched = bucket.get(values)
+            except (KeyError, TypeError):
+                # Missing or unhashable values match nothing
+                continue
+            if matched:
+                selected = (selected or []) + matched
+
+        for order, callback, predicate in self.predicates:
+            if predicate(kwargs):
+                selected = selected or []
+                selected.append((order, callback))
 
+        if selected is None:
+            return self.always
 
-def disconnect(callback):
+        # Orders are unique, so callbacks themselves are never compared
+        selected.extend(self._always)
+        selected.sort()
+        return tuple([callback for order, callback in selected])
+
+    def changed(self, order, callback, match, added):
+        """
+        Returns the filters of this plan with a callback added or removed. Only the
+        bucket of its match is copied, the others are shared with these filters
+
+        :param order: The callback's place in the call order
+        :param callback: The callback added or removed
+        :param match: Its filter, a dict, a predicate or None
+        :param added: True if the callback was added, False if it was removed
+        :returns: New filters, or None if no callback of the plan is filtered anymore
+        """
+        filters = _Filters()
+        filters.always, filters._always = self.always, self._always
+        filters.buckets, filters.predicates = self.buckets, self.predicates
+        entry = (order, callback)
+
+        if match is None:
+            always = list(self._always)
+            position = bisect.bisect_left(always, (order,))
+            if added:
+                always.insert(position, entry)
+                filters.always = self.always[:position] + (callback,) + self.always[position:]
+            else:
+                del always[position]
+                filters.always = self.always[:position] + self.always[position + 1:]
+            filters._always = always
+        elif isinstance(match, dict):
+            keys, values = _match_key(match)
+            buckets = filters.buckets = dict(self.buckets)
+            bucket = buckets[keys] = dict(buckets.get(keys, ()))
+            entries = list(bucket.get(values, ()))
+            position = bisect.bisect_left(entries, (order,))
+            if added:
+                entries.insert(position, entry)
+            else:
+                del entries[position]
+            if entries:
+                bucket[values] = entries
+            else:
+                del bucket[values]
+                if not bucket:
+                    del buckets[keys]
+        else:
+            predicates = list(self.predicates)
+            position = bisect.bisect_left(predicates, (order,))
+            if added:
+                predicates.insert(position, (order, callback, match))
+            else:
+                del predicates[position]
+            filters.predicates = predicates
+
+        if not filters.buckets and not filters.predicates:
+            return None
+        return filters
+
+
+def _match_key(match):
+    """
+    Returns the sorted keys of a dict filter and the values it requires for them,
+    which index the callbacks filtered by it
     """
-    Removes a callback from all signal registries and prevents it from responding
-    to any emitted signal.
+    keys = tuple(sorted(match))
+    return keys, tuple(match[key] for key in keys)
 
-    :param callback: A callable registered with smokesignal
+
+class _Rate(object):
+    """
+    The rate limit of a callback on a signal, applied by `Dispatcher._claim' with the
+    dispatcher's lock held. Emissions are sampled first, then throttled, then debounced
+
+    :param throttle: Seconds to drop emissions for after each call, or None
+    :param debounce: Seconds without emissions to wait for before a call, or None
+    :param sample: The fraction of emissions to call the callback for, or None
     """
-    # This is basically what `disconnect_from` does, but that method guards against
-    # callbacks not responding to signal arguments. We don't need that because we're
-    # disconnecting all the valid ones here
-    for signal in signals(callback):
-        receivers[signal].remove(callback)
+    __slots__ = ('settings', 'throttle', 'debounce', 'sample', '_credit', '_until', '_held',
+                 '_due', '_timer')
+
+    def __init__(self, throttle=None, debounce=None, sample=None):
+        self.settings = (throttle, debounce, sample)
+        self.throttle = throttle
+        self.debounce = debounce
+        self.sample = sample
+        self._credit = 0.0
+        self._until = None
+        self._held = None
+        self._due = None
+        self._timer = None
 
+    def admit(self, dispatcher, signal, callback, args, kwargs):
+        """
+        Returns True if the callback may be called for an emission now. A debounced
+        emission is held on to instead, replacing any held before it
+        """
+        # Sampling is deterministic: every emission adds its fraction of a call
+        if self.sample is not None:
+            self._credit += self.sample
+            if self._credit < 1:
+                return False
+            self._credit -= 1
 
-def disconnect_from(callback, signals):
+        if self.throttle is not None:
+            now = _monotonic()
+            if self._until is not None and now < self._until:
+                return False
+            self._until = now + self.throttle
+
+        # Debouncing pushes the deadline of a single timer back rather than scheduling
+        # a timer per emission
+        if self.debounce is not None:
+            self._held = (args, kwargs)
+            self._due = _monotonic() + self.debounce
+            if self._timer is None:
+                self._schedule(self.debounce, dispatcher, signal, callback)
+            return False
+
+        return True
+
+    def cancel(self):
+        """
+        Drops any emission held on to by debouncing
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._held = None
+
+    def _schedule(self, delay, dispatcher, signal, callback):
+        self._timer = _timers.call_later(
+            delay, partial(self._expire, dispatcher, signal, callback))
+
+    def _expire(self, dispatcher, signal, callback):
+        with dispatcher._lock:
+            if self._timer is None:
+                return
+            remaining = self._due - _monotonic()
+            if remaining > 0:
+                self._schedule(remaining, dispatcher, signal, callback)
+                return
+            args, kwargs = self._held
+            self._timer = self._held = None
+
+        dispatcher._fire(signal, callback, args, kwargs)
+
+
+class _Timers(object):
+    """
+    Runs delayed calls, for debounced callbacks and buffered signals, from a single
+    timer thread shared by all of them. The thread is started on first use, and again
+    in the child of a fork
     """
-    Removes a callback from specified signal registries and prevents it from responding
-    to any emitted signal.
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._count = 0
 
-    :param callback: A callable registered with smokesignal
-    :param signals: A single signal or list/tuple of signals
+    def call_later(self, delay, fn):
+        """
+        Calls fn after delay seconds. Calls due at the same time are made in the order
+        they were scheduled
+
+        :returns: A timer, whose `cancel' method keeps the call from being made
+        """
+        timer = _Timer(_monotonic() + delay, fn)
+        with self._cond:
+            self._count += 1
+            heapq.heappush(self._heap, (timer.deadline, self._count, timer))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='smokesignal-timers')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return timer
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    remaining = self._heap[0][0] - _monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                deadline, count, timer = heapq.heappop(self._heap)
+
+            # A call can cancel its own timer, so it is taken off the timer first
+            fn = timer.fn
+            if fn is None:
+                continue
+            try:
+                fn()
+            except Exception:
+                _log.exception('Delayed call %r failed', fn)
+
+
+class _Timer(object):
+    """
+    A call scheduled by `_Timers.call_later'
     """
-    # Support for lists of signals
-    if not isinstance(signals, (list, tuple)):
-        signals = [signals]
+    __slots__ = ('deadline', 'fn')
+
+    def __init__(self, deadline, fn):
+        self.deadline = deadline
+        self.fn = fn
 
-    # Remove callback from receiver list if it responds to the signal
-    for signal in signals:
-        if responds_to(callback, signal):
-            receivers[signal].remove(callback)
+    def cancel(self):
+        self.fn = None
 
 
-def clear(*signals):
+_timers = _Timers()
+
+
+class _Logger(object):
     """
-    Clears all callbacks for a particular signal or signals
+    Stands in for the 'smokesignal' logger, so `logging' is only imported once
+    something is logged
     """
-    signals = signals if signals else receivers.keys()
+    def __getattr__(self, name):
+        import logging
+        return getattr(logging.getLogger('smokesignal'), name)
 
-    for signal in signals:
-        receivers[signal].clear()
 
+_log = _Logger()
 
-def clear_all():
+
+class _PatternTrie(object):
     """
-    Clears all callbacks for all signals
+    Trie of signal patterns keyed by their dot-separated segments. A '*' segment
+    matches exactly one segment of a signal, and a '#' segment matches zero or more
     """
-    for key in receivers.keys():
-        receivers[key].clear()
+    __slots__ = ('children', 'pattern')
+
+    def __init__(self):
+        self.children = {}
+        self.pattern = None
+
+    def __bool__(self):
+        return bool(self.children)
+
+    __nonzero__ = __bool__
+
+    def set(self, pattern, present):
+        """
+        Adds a pattern to the trie, or removes it and prunes any emptied nodes
+        """
+        path = [self]
+        for segment in pattern.split('.'):
+            node = path[-1].children.get(segment)
+            if node is None:
+                if not present:
+                    return
+                node = path[-1].children[segment] = _PatternTrie()
+            path.append(node)
+
+        path[-1].pattern = pattern if present else None
+
+        segments = pattern.split('.')
+        while len(path) > 1 and path[-1].pattern is None and not path[-1].children:
+            path.pop()
+            del path[-1].children[segments[len(path) - 1]]
+
+    def match(self, signal):
+        """
+        Returns the patterns matching a signal, in no particular order
+        """
+        found = set()
+        self._match(signal.split('.'), 0, found)
+        return found
+
+    def _match(self, segments, i, found):
+        if i == len(segments):
+            if self.pattern is not None:
+                found.add(self.pattern)
+        else:
+            for key in (segments[i], '*'):
+                child = self.children.get(key)
+                if child is not None:
+                    child._match(segments, i + 1, found)
+
+        # '#' can swallow any number of the remaining segments, including none
+        child = self.children.get('#')
+        if child is not None:
+            for j in range(i, len(segments) + 1):
+                child._match(segments, j, found)
+
+
+# The dispatcher behind the module-level functions
+_default = Dispatcher()
 
-_twisted_support = install_twisted()
+receivers = _default.receivers
+emit = _default.emit
+emit_lazy = _default.emit_lazy
+emit_reduce = _default.emit_reduce
+emit_results = _default.emit_results
+emit_many = _default.emit_many
+emit_async = _default.emit_async
+emit_futures = _default.emit_futures
+emitting = _default.emitting
+signal = _default.signal
+signals = _default.signals
+responds_to = _default.responds_to
+set_error_policy = _default.set_error_policy
+has_receivers = _default.has_receivers
+on = _default.on
+once = _default.once
+disconnect = _default.disconnect
+disconnect_from = _default.disconnect_from
+clear = _default.clear
+clear_all = _default.clear_all
+_call = _default._call
 
+set_backend('auto')
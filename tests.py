@@ -1,25 +1,49 @@
 """ Unit tests """
+import gc
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
 import types
-
-from collections import defaultdict
+import weakref
 
 import pytest
 
-from mock import Mock, call, patch
+from mock import MagicMock, Mock, call, patch
 
 import smokesignal
 
-if smokesignal._twisted_support:
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
+# Test the Twisted backend whenever Twisted is installed
+if smokesignal.install_twisted():
     from tests_twisted import TestTwisted
 
+if sys.version_info >= (3, 7):
+    from tests_asyncio import TestAsyncio
+
+
+def square(n):
+    return n * n
+
 
 class TestSmokesignal(object):
 
     def setup(self):
         self.fn = Mock(spec=types.FunctionType)
-        patch.object(smokesignal, 'receivers', defaultdict(set)).start()
+        patch.object(smokesignal, '_hooks', ()).start()
+        patch.object(smokesignal, '_stats', None).start()
+        smokesignal.clear_all()
 
     def teardown(self):
+        smokesignal.clear_all()
+        smokesignal.set_error_policy('raise')
         patch.stopall()
 
     def test_call_no_max_calls(self):
@@ -28,54 +52,46 @@ class TestSmokesignal(object):
         assert self.fn.call_count == 5
 
     def test_call_with_max_calls(self):
-        self.fn._max_calls = 1
+        smokesignal.on('foo', self.fn, max_calls=1)
         for x in range(5):
-            smokesignal._call(self.fn)
+            smokesignal._call(self.fn, limit='foo')
         assert self.fn.call_count == 1
+        assert not smokesignal.responds_to(self.fn, 'foo')
 
     def test_clear(self):
         smokesignal.on('foo', self.fn)
-        assert smokesignal.receivers['foo'] == set([self.fn])
+        assert smokesignal.receivers['foo'] == (self.fn,)
 
         smokesignal.clear('foo')
-        assert smokesignal.receivers['foo'] == set()
+        assert 'foo' not in smokesignal.receivers
 
     def test_clear_no_args_clears_all(self):
         smokesignal.on(('foo', 'bar', 'baz'), self.fn)
         assert smokesignal.receivers == {
-            'foo': set([self.fn]),
-            'bar': set([self.fn]),
-            'baz': set([self.fn]),
+            'foo': (self.fn,),
+            'bar': (self.fn,),
+            'baz': (self.fn,),
         }
 
         smokesignal.clear()
-        assert smokesignal.receivers == {
-            'foo': set(),
-            'bar': set(),
-            'baz': set(),
-        }
+        assert smokesignal.receivers == {}
 
     def test_clear_many(self):
         smokesignal.on(('foo', 'bar', 'baz'), self.fn)
         smokesignal.clear('foo', 'bar')
         assert smokesignal.receivers == {
-            'foo': set(),
-            'bar': set(),
-            'baz': set([self.fn]),
+            'baz': (self.fn,),
         }
 
     def test_clear_all(self):
         smokesignal.on(('foo', 'bar'), self.fn)
         assert smokesignal.receivers == {
-            'foo': set([self.fn]),
-            'bar': set([self.fn]),
+            'foo': (self.fn,),
+            'bar': (self.fn,),
         }
 
         smokesignal.clear_all()
-        assert smokesignal.receivers == {
-            'foo': set(),
-            'bar': set(),
-        }
+        assert smokesignal.receivers == {}
 
     def test_emit_with_no_callbacks(self):
         try:
@@ -83,6 +99,27 @@ class TestSmokesignal(object):
         except:
             pytest.fail('Emitting a signal with no callback should not have raised')
 
+    def test_lookups_do_not_grow_registry(self):
+        smokesignal.on('foo', self.fn)
+        for x in range(1000000):
+            smokesignal.emit(x)
+            smokesignal.responds_to(self.fn, x)
+
+        smokesignal.clear(*range(1000))
+        smokesignal.disconnect_from(self.fn, list(range(1000)))
+
+        assert list(smokesignal.receivers) == ['foo']
+        assert list(smokesignal._default._plans) == ['foo']
+
+    def test_disconnect_prunes_empty_signals(self):
+        smokesignal.on(('foo', 'bar'), self.fn)
+        smokesignal.disconnect_from(self.fn, 'foo')
+        assert smokesignal.receivers == {'bar': (self.fn,)}
+
+        smokesignal.disconnect(self.fn)
+        assert smokesignal.receivers == {}
+        assert smokesignal._default._plans == {}
+
     def test_emit_with_callbacks(self):
         # Register first
         smokesignal.on('foo', self.fn)
@@ -95,13 +132,132 @@ class TestSmokesignal(object):
         smokesignal.emit('foo', 1, 2, 3, foo='bar')
         self.fn.assert_called_with(1, 2, 3, foo='bar')
 
+    def test_emit_does_not_copy_receivers(self):
+        smokesignal.on('foo', self.fn)
+        snapshot = smokesignal.receivers['foo']
+        smokesignal.emit('foo')
+        assert smokesignal.receivers['foo'] is snapshot
+
+    def test_emit_ignores_receivers_added_during_emit(self):
+        late = Mock(spec=types.FunctionType)
+
+        @smokesignal.on('foo')
+        def add_late():
+            smokesignal.on('foo', late)
+
+        smokesignal.emit('foo')
+        assert not late.called
+
+        smokesignal.emit('foo')
+        assert late.call_count == 1
+
+    def test_emit_calls_receivers_disconnected_during_emit(self):
+        calls = []
+
+        def first():
+            calls.append('first')
+            smokesignal.disconnect(second)
+
+        def second():
+            calls.append('second')
+
+        smokesignal.on('foo', first)
+        smokesignal.on('foo', second)
+        smokesignal.emit('foo')
+        assert calls == ['first', 'second']
+
+        smokesignal.emit('foo')
+        assert calls == ['first', 'second', 'first']
+
+    def test_emit_unlimited_skips_call(self):
+        smokesignal.on('foo', self.fn)
+        with patch.object(smokesignal, '_call') as _call:
+            smokesignal.emit('foo', 1, foo='bar')
+        assert not _call.called
+        self.fn.assert_called_with(1, foo='bar')
+
+    @pytest.mark.skipif(smokesignal._twisted_support,
+                        reason='Twisted claims calls before calling callbacks directly')
+    def test_emit_limited_uses_call(self):
+        other = Mock(spec=types.FunctionType)
+        smokesignal.on('foo', self.fn, max_calls=2)
+        smokesignal.on('foo', other)
+        with patch.object(smokesignal.Dispatcher, '_call') as _call:
+            smokesignal.emit('foo', 1)
+        _call.assert_called_once_with(self.fn, (1,), {}, limit='foo', signal='foo')
+        other.assert_called_with(1)
+
+    def test_on_max_calls_recompiles_existing_signals(self):
+        smokesignal.on('foo', self.fn)
+        assert smokesignal._default._plans['foo'][1] is None
+
+        smokesignal.on('foo', self.fn, max_calls=1)
+        assert smokesignal._default._plans['foo'][1] == {self.fn: 'foo'}
+
+        smokesignal.on('foo', self.fn)
+        assert smokesignal._default._plans['foo'][1] is None
+
+    def test_max_calls_per_signal(self):
+        smokesignal.on('foo', self.fn)
+        smokesignal.on('bar', self.fn, max_calls=1)
+        smokesignal.on('baz', self.fn, max_calls=2)
+        assert smokesignal._default._plans['foo'][1] is None
+
+        for x in range(3):
+            smokesignal.emit('foo')
+            smokesignal.emit('bar')
+            smokesignal.emit('baz')
+
+        assert self.fn.call_count == 6
+        assert smokesignal.signals(self.fn) == ('foo',)
+
+    def test_max_calls_removed_on_last_call(self):
+        smokesignal.on('foo', self.fn)
+        smokesignal.once('bar', self.fn)
+
+        smokesignal.emit('bar')
+        assert 'bar' not in smokesignal.receivers
+        assert smokesignal.responds_to(self.fn, 'foo')
+        assert smokesignal._default._budgets == {}
+
+    def test_max_calls_pattern(self):
+        smokesignal.on('foo.*', self.fn, max_calls=2)
+        smokesignal.on('foo.bar', self.fn)
+
+        for x in range(3):
+            smokesignal.emit('foo.baz')
+            smokesignal.emit('foo.bar')
+
+        assert self.fn.call_count == 5
+        assert smokesignal.signals(self.fn) == ('foo.bar',)
+
+    def test_max_calls_with_hooks(self):
+        smokesignal.add_hook(smokesignal.Hook())
+        smokesignal.once('foo', self.fn)
+        smokesignal.emit('foo')
+        smokesignal.emit('foo')
+        assert self.fn.call_count == 1
+        assert smokesignal.receivers == {}
+
+    def test_max_calls_emit_many(self):
+        smokesignal.on('foo', self.fn, max_calls=2)
+        smokesignal.emit_many('foo', [1, 2, 3])
+        assert self.fn.call_count == 2
+        assert smokesignal.receivers == {}
+
+    def test_max_calls_emit_results(self):
+        self.fn.return_value = 1
+        smokesignal.once('foo', self.fn)
+        assert smokesignal.emit_results('foo') == [1]
+        assert smokesignal.emit_results('foo') == []
+
     def test_on_must_have_callables(self):
         with pytest.raises(AssertionError):
             smokesignal.on('foo', 'bar')
 
     def test_on_registers(self):
         smokesignal.on('foo', self.fn)
-        assert smokesignal.receivers['foo'] == set([self.fn])
+        assert smokesignal.receivers['foo'] == (self.fn,)
 
     def test_on_registers_many(self):
         assert smokesignal.receivers == {}
@@ -109,8 +265,8 @@ class TestSmokesignal(object):
         smokesignal.on(('foo', 'bar'), self.fn)
 
         assert smokesignal.receivers == {
-            'foo': set([self.fn]),
-            'bar': set([self.fn]),
+            'foo': (self.fn,),
+            'bar': (self.fn,),
         }
 
     def test_on_max_calls(self):
@@ -122,13 +278,13 @@ class TestSmokesignal(object):
             smokesignal.emit('foo')
 
         assert self.fn.call_count == 3
-        assert smokesignal.receivers['foo'] == set()
+        assert 'foo' not in smokesignal.receivers
 
     def test_on_decorator_registers(self):
         @smokesignal.on('foo')
         def my_callback():
             pass
-        assert smokesignal.receivers['foo'] == set([my_callback])
+        assert smokesignal.receivers['foo'] == (my_callback,)
 
     def test_on_decorator_registers_many(self):
         @smokesignal.on(('foo', 'bar'))
@@ -136,8 +292,8 @@ class TestSmokesignal(object):
             pass
 
         assert smokesignal.receivers == {
-            'foo': set([my_callback]),
-            'bar': set([my_callback]),
+            'foo': (my_callback,),
+            'bar': (my_callback,),
         }
 
     def test_on_decorator_max_calls(self):
@@ -199,6 +355,32 @@ class TestSmokesignal(object):
         assert 'foo' in smokesignal.signals(self.fn)
         assert 'bar' in smokesignal.signals(self.fn)
 
+    def test_signals_uses_index(self):
+        smokesignal.on(('foo', 'bar'), self.fn)
+        with patch.object(smokesignal.Dispatcher, 'responds_to') as responds_to:
+            assert set(smokesignal.signals(self.fn)) == set(['foo', 'bar'])
+        assert not responds_to.called
+
+    def test_signals_unknown_callback(self):
+        assert smokesignal.signals(self.fn) == ()
+
+    def test_clear_updates_index(self):
+        other = Mock(spec=types.FunctionType)
+        smokesignal.on(('foo', 'bar'), self.fn)
+        smokesignal.on('foo', other)
+
+        smokesignal.clear('foo')
+        assert smokesignal.signals(self.fn) == ('bar',)
+        assert smokesignal._default._index == {self.fn: set(['bar'])}
+
+        smokesignal.clear_all()
+        assert smokesignal._default._index == {}
+
+    def test_disconnect_drops_index_entry(self):
+        smokesignal.on(('foo', 'bar'), self.fn)
+        smokesignal.disconnect(self.fn)
+        assert smokesignal._default._index == {}
+
     def test_responds_to_true(self):
         # Register first
         smokesignal.on('foo', self.fn)
@@ -220,7 +402,7 @@ class TestSmokesignal(object):
         smokesignal.emit('foo')
 
         assert self.fn.call_count == 1
-        assert smokesignal.receivers['foo'] == set()
+        assert 'foo' not in smokesignal.receivers
 
     def test_once_decorator(self):
         # Register and call twice
@@ -230,13 +412,13 @@ class TestSmokesignal(object):
 
         assert self.fn.call_count == 1
 
-    @patch('smokesignal.emit')
+    @patch.object(smokesignal.Dispatcher, 'emit')
     def test_emitting_arg_style(self, emit):
         with smokesignal.emitting('foo'):
             pass
         emit.assert_called_with('foo')
 
-    @patch('smokesignal.emit')
+    @patch.object(smokesignal.Dispatcher, 'emit')
     def test_emitting_kwarg_style(self, emit):
         with smokesignal.emitting(enter='foo', exit='bar'):
             pass
@@ -323,3 +505,1635 @@ class TestSmokesignal(object):
         for x in range(5):
             smokesignal.emit('foo')
         assert foo.foo_count == 1
+
+    def test_instance_method_disconnect(self):
+        class Foo(object):
+            def foo(self):
+                pass
+
+        foo = Foo()
+        smokesignal.on(('foo', 'bar'), foo.foo)
+        assert smokesignal.responds_to(foo.foo, 'foo')
+        assert set(smokesignal.signals(foo.foo)) == set(['foo', 'bar'])
+
+        smokesignal.disconnect_from(foo.foo, 'foo')
+        assert not smokesignal.responds_to(foo.foo, 'foo')
+
+        smokesignal.disconnect(foo.foo)
+        assert smokesignal.receivers == {}
+
+    def test_instance_method_not_registered_twice(self):
+        class Foo(object):
+            def foo(self):
+                self.count += 1
+
+        foo = Foo()
+        foo.count = 0
+        smokesignal.on('foo', foo.foo)
+        smokesignal.on('foo', foo.foo)
+        smokesignal.emit('foo')
+        assert foo.count == 1
+
+    def test_weak_instance_method(self):
+        class Foo(object):
+            def foo(self, n):
+                self.count += n
+
+        foo = Foo()
+        foo.count = 0
+        smokesignal.on('foo', foo.foo, weak=True)
+        smokesignal.emit('foo', 2)
+        assert foo.count == 2
+        assert smokesignal.responds_to(foo.foo, 'foo')
+
+        ref = weakref.ref(foo)
+        del foo
+        gc.collect()
+        assert ref() is None
+        assert smokesignal.receivers == {}
+        assert smokesignal._default._index == {}
+
+    def test_weak_function(self):
+        def foo():
+            pass
+
+        assert smokesignal.on('foo', foo, weak=True) is foo
+        assert smokesignal.responds_to(foo, 'foo')
+
+        foo.disconnect()
+        assert smokesignal.receivers == {}
+
+        smokesignal.once('foo', foo, weak=True)
+        del foo
+        gc.collect()
+        assert smokesignal.receivers == {}
+
+    def test_weak_decorator(self):
+        @smokesignal.on('foo', weak=True)
+        def foo():
+            pass
+
+        assert smokesignal.responds_to(foo, 'foo')
+
+    def test_weak_dead_receiver_dropped_on_emit(self):
+        class Foo(object):
+            def foo(self):
+                pass
+
+        foo = Foo()
+        receiver = smokesignal.on('foo', foo.foo, weak=True)
+        receiver._ref = lambda: None
+
+        smokesignal.emit('foo')
+        assert smokesignal.receivers == {}
+
+    def test_weak_receivers_do_not_leak(self):
+        class Foo(object):
+            def __init__(self):
+                smokesignal.on(('foo', 'bar'), self.foo, weak=True)
+
+            def foo(self):
+                pass
+
+        for x in range(100000):
+            Foo()
+
+        gc.collect()
+        assert smokesignal.receivers == {}
+        assert smokesignal._default._index == {}
+
+    def _hammer(self, target, threads=32):
+        """
+        Runs target concurrently from many threads with frequent thread switches
+        """
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        errors = []
+
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        try:
+            workers = [threading.Thread(target=run) for x in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        assert errors == []
+
+    def test_once_threaded(self):
+        for x in range(20):
+            calls = []
+            smokesignal.once('foo', lambda: calls.append(1))
+
+            def emit():
+                for y in range(50):
+                    smokesignal.emit('foo')
+
+            self._hammer(emit)
+            assert len(calls) == 1
+            assert smokesignal.receivers == {}
+
+    def test_max_calls_threaded(self):
+        calls = []
+        smokesignal.on('foo', lambda: calls.append(1), max_calls=500)
+
+        def emit():
+            for y in range(100):
+                smokesignal.emit('foo')
+
+        self._hammer(emit)
+        assert len(calls) == 500
+
+    def test_register_while_emitting_threaded(self):
+        def churn():
+            for y in range(200):
+                fn = lambda: None
+                smokesignal.on(('foo', 'bar'), fn)
+                smokesignal.emit('foo')
+                smokesignal.signals(fn)
+                smokesignal.disconnect_from(fn, 'foo')
+                smokesignal.disconnect(fn)
+                smokesignal.clear('baz')
+
+        self._hammer(churn)
+        assert smokesignal.receivers == {}
+        assert smokesignal._default._index == {}
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_on_executor(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        with ThreadPoolExecutor(1) as pool:
+            smokesignal.on('foo', slow, executor=pool)
+            smokesignal.on('foo', self.fn)
+
+            # emit returns without waiting on the slow callback
+            smokesignal.emit('foo')
+            assert self.fn.called
+            assert started.wait(5)
+            release.set()
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_on_executor_max_calls(self):
+        calls = []
+        with ThreadPoolExecutor(2) as pool:
+            smokesignal.once('foo', lambda: calls.append(1), executor=pool)
+            for x in range(5):
+                smokesignal.emit('foo')
+        assert calls == [1]
+        assert smokesignal.receivers == {}
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_on_executor_kept(self):
+        with ThreadPoolExecutor(1) as pool:
+            smokesignal.on('foo', self.fn, executor=pool)
+            smokesignal.on('bar', self.fn)
+            assert smokesignal._default._plans['foo'][1] == {self.fn: None}
+            assert smokesignal._default._plans['bar'][1] == {self.fn: None}
+
+            smokesignal.on('foo', self.fn, executor=None)
+            assert smokesignal._default._plans['foo'][1] is None
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_on_executor_bound_method(self):
+        class Handler(object):
+            def handle(self):
+                return threading.current_thread()
+
+        handler = Handler()
+        with ThreadPoolExecutor(1) as pool:
+            smokesignal.on('foo', handler.handle, executor=pool)
+            smokesignal.on('bar', handler.handle)
+            future, = smokesignal.emit_futures('foo')
+            assert future.result() is not threading.current_thread()
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    @patch('smokesignal._log')
+    def test_on_executor_error_logged(self, log):
+        def fail(n):
+            raise ValueError(n)
+
+        with ThreadPoolExecutor(1) as pool:
+            smokesignal.on('foo', fail, executor=pool)
+            smokesignal.emit('foo', 1)
+            smokesignal.signal('foo').emit(2)
+            smokesignal.emit_many('foo', [3, 4])
+
+        errors = [c[1]['exc_info'].args for c in log.error.call_args_list]
+        assert sorted(errors) == [(1,), (2,), (3,), (4,)]
+        assert all(c[0][1:] == (fail, 'foo') for c in log.error.call_args_list)
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    @patch('smokesignal._log')
+    def test_on_executor_error_circuit_breaker(self, log):
+        def fail():
+            raise ValueError()
+
+        smokesignal.set_error_policy(smokesignal.CircuitBreaker(failures=2, window=60))
+        with ThreadPoolExecutor(1) as pool:
+            smokesignal.on('foo', fail, executor=pool)
+            smokesignal.emit('foo')
+            smokesignal.emit('foo')
+        assert not smokesignal.responds_to(fail, 'foo')
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_emit_futures_inline(self):
+        def fail(n):
+            1/0
+
+        smokesignal.on('foo', square)
+        smokesignal.on('foo', fail)
+
+        futures = smokesignal.emit_futures('foo', 3)
+        assert all(f.done() for f in futures)
+        assert futures[0].result() == 9
+        assert isinstance(futures[1].exception(), ZeroDivisionError)
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_emit_futures_executor(self):
+        threads = []
+        with ThreadPoolExecutor(1) as pool, ThreadPoolExecutor(1) as bound:
+            smokesignal.on('foo', lambda: threads.append(threading.current_thread()))
+            smokesignal.on('foo', lambda: threads.append(threading.current_thread()),
+                           executor=bound)
+            for future in smokesignal.emit_futures('foo', executor=pool):
+                future.result()
+        assert len(threads) == 2
+        assert threading.current_thread() not in threads
+        assert threads[0] is not threads[1]
+
+    @pytest.mark.skipif(ProcessPoolExecutor is None, reason='requires concurrent.futures')
+    def test_emit_futures_process_pool(self):
+        smokesignal.on('foo', square)
+        with ProcessPoolExecutor(2) as pool:
+            futures = smokesignal.emit_futures('foo', 7, executor=pool)
+            assert [f.result() for f in futures] == [49]
+
+    def test_emit_many(self):
+        smokesignal.on('foo', self.fn)
+        smokesignal.emit_many('foo', iter([1, 2, 3]), bar='baz')
+        assert self.fn.call_args_list == [call(1, bar='baz'), call(2, bar='baz'),
+                                          call(3, bar='baz')]
+
+    def test_emit_many_batch(self):
+        batch = Mock(spec=types.FunctionType)
+        smokesignal.on('foo', self.fn)
+        smokesignal.on('foo', batch, batch=True)
+
+        smokesignal.emit_many('foo', (x for x in range(3)))
+        batch.assert_called_once_with([0, 1, 2])
+        assert self.fn.call_count == 3
+
+    def test_emit_many_no_callbacks(self):
+        payloads = MagicMock()
+        smokesignal.emit_many('foo', payloads)
+        assert not payloads.__iter__.called
+
+    def test_emit_many_max_calls(self):
+        batch = Mock(spec=types.FunctionType)
+        smokesignal.on('foo', self.fn, max_calls=2)
+        smokesignal.once('foo', batch, batch=True)
+
+        smokesignal.emit_many('foo', [1, 2, 3])
+        smokesignal.emit_many('foo', [4, 5])
+        assert self.fn.call_args_list == [call(1), call(2)]
+        batch.assert_called_once_with([1, 2, 3])
+
+    def test_emit_batch(self):
+        smokesignal.on('foo', self.fn, batch=True)
+        smokesignal.emit('foo', 1, bar='baz')
+        self.fn.assert_called_once_with([1], bar='baz')
+
+    def test_plan_patched(self):
+        bus = smokesignal.Dispatcher()
+        bound = bus.signal('foo')
+        callbacks = [Mock(spec=types.FunctionType) for x in range(4)]
+        bus.on('foo', callbacks[0])
+        bus.on('foo', callbacks[1], max_calls=2)
+        bus.on('foo', callbacks[2], batch=True)
+        bus.on('foo', callbacks[3], priority=1)
+        assert bus._plans['foo'] == bus._compile('foo')
+        assert bound._plan is bus._plans['foo']
+
+        for callback in callbacks:
+            bus.disconnect(callback)
+            assert bus._plans.get('foo') == bus._compile('foo')
+        assert bound._plan is smokesignal._no_plan
+
+    def test_plan_patched_filters(self):
+        bus = smokesignal.Dispatcher()
+        callbacks = [Mock(spec=types.FunctionType) for x in range(6)]
+        bus.on('foo', callbacks[0])
+        bus.on('foo', callbacks[1], match={'tenant': 'acme'})
+        bus.on('foo', callbacks[2], match={'tenant': 'acme', 'size': 1}, priority=1)
+        bus.on('foo', callbacks[3], match=lambda kwargs: kwargs.get('size') == 1)
+        bus.on('foo', callbacks[4], match={'tenant': 'globex'}, max_calls=5)
+        bus.on('foo', callbacks[5])
+
+        emits = [{}, {'tenant': 'acme'}, {'tenant': 'acme', 'size': 1}, {'size': 1},
+                 {'tenant': 'globex'}]
+        for callback in [None] + callbacks:
+            if callback is not None:
+                bus.disconnect(callback)
+            plan, compiled = bus._plans.get('foo'), bus._compile('foo')
+            if compiled is None:
+                assert plan is None
+                continue
+            assert plan[:2] == compiled[:2]
+            if compiled[2] is None:
+                assert plan[2] is None
+                continue
+            for kwargs in emits:
+                assert plan[2].select(kwargs) == compiled[2].select(kwargs)
+
+    def test_on_decorator_batch(self):
+        @smokesignal.on('foo', batch=True)
+        def my_callback(payloads):
+            pass
+
+        assert my_callback._batch
+        assert smokesignal._default._plans['foo'][1] == {my_callback: None}
+
+    def test_on_batch_kept(self):
+        smokesignal.on('foo', self.fn, batch=True)
+        smokesignal.on('bar', self.fn)
+        smokesignal.emit('foo', 1)
+        smokesignal.emit('bar', 2)
+        assert self.fn.call_args_list == [call([1]), call([2])]
+
+        smokesignal.on('foo', self.fn, batch=False)
+        smokesignal.emit('foo', 3)
+        self.fn.assert_called_with(3)
+
+    def test_buffered_signal_size(self):
+        smokesignal.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo', size=3)
+
+        buffered.emit(1)
+        buffered.emit(2)
+        assert not self.fn.called
+        assert len(buffered) == 2
+
+        buffered.emit(3, bar='baz')
+        assert self.fn.call_args_list == [call(1), call(2), call(3, bar='baz')]
+        assert len(buffered) == 0
+
+    def test_buffered_signal_interval(self):
+        flushed = threading.Event()
+        smokesignal.on('foo', lambda n: flushed.set())
+        buffered = smokesignal.BufferedSignal('foo', interval=0.01)
+
+        buffered.emit(1)
+        assert flushed.wait(5)
+        assert len(buffered) == 0
+
+    def test_buffered_signal_interval_errors(self):
+        self.fn.side_effect = ValueError
+        smokesignal.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo', interval=0.01)
+
+        logged = threading.Event()
+        with patch.object(smokesignal, '_log') as log:
+            log.exception.side_effect = lambda *args: logged.set()
+            buffered.emit(1)
+            assert logged.wait(5)
+        self.fn.assert_called_once_with(1)
+        assert log.exception.call_args[0][1] == buffered.flush
+
+    def test_buffered_signal_last(self):
+        smokesignal.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo', strategy='last')
+        for x in range(5):
+            buffered.emit(x)
+
+        assert buffered.flush() == 1
+        self.fn.assert_called_once_with(4)
+
+    def test_buffered_signal_key(self):
+        smokesignal.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo', strategy='key',
+                                              key=lambda name, value: name)
+        buffered.emit('a', 1)
+        buffered.emit('b', 2)
+        buffered.emit('a', 3)
+
+        assert buffered.flush() == 2
+        assert self.fn.call_args_list == [call('a', 3), call('b', 2)]
+
+    def test_buffered_signal_bad_strategy(self):
+        with pytest.raises(ValueError):
+            smokesignal.BufferedSignal('foo', strategy='nope')
+
+        with pytest.raises(ValueError):
+            smokesignal.BufferedSignal('foo', strategy='key')
+
+    def test_buffered_signal_context_manager(self):
+        smokesignal.on('foo', self.fn)
+        with smokesignal.BufferedSignal('foo') as buffered:
+            buffered.emit(1)
+            assert not self.fn.called
+        self.fn.assert_called_once_with(1)
+
+    def test_emitting_flushes_buffers(self):
+        calls = []
+        smokesignal.on('foo', lambda n: calls.append(n))
+        smokesignal.on('done', lambda: calls.append('done'))
+        buffered = smokesignal.BufferedSignal('foo')
+
+        with smokesignal.emitting('done'):
+            buffered.emit(1)
+            buffered.emit(2)
+            assert calls == []
+
+        assert calls == [1, 2, 'done']
+
+    def test_emitting_flushes_own_buffers(self):
+        dispatcher = smokesignal.Dispatcher()
+        smokesignal.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo')
+
+        with dispatcher.emitting('done'):
+            buffered.emit(1)
+
+        assert not self.fn.called
+        buffered.flush()
+        self.fn.assert_called_once_with(1)
+
+    @patch('smokesignal._log')
+    def test_emitting_flush_error_keeps_body_error(self, log):
+        def broken(n):
+            raise ValueError(n)
+
+        smokesignal.on('foo', broken)
+        smokesignal.on('done', self.fn)
+        buffered = smokesignal.BufferedSignal('foo')
+
+        with pytest.raises(KeyError):
+            with smokesignal.emitting('done'):
+                buffered.emit(1)
+                raise KeyError('body')
+
+        self.fn.assert_called_once_with()
+        assert log.exception.called
+
+    def test_emitting_flush_error_still_emits_exit(self):
+        def broken(n):
+            raise ValueError(n)
+
+        smokesignal.on('foo', broken)
+        smokesignal.on('done', self.fn)
+        buffered = smokesignal.BufferedSignal('foo')
+
+        with pytest.raises(ValueError):
+            with smokesignal.emitting('done'):
+                buffered.emit(1)
+
+        self.fn.assert_called_once_with()
+
+    def test_pattern_star(self):
+        smokesignal.on('order.*', self.fn)
+        smokesignal.emit('order.created', 1)
+        smokesignal.emit('order')
+        smokesignal.emit('order.created.late')
+        smokesignal.emit('invoice.created')
+        self.fn.assert_called_once_with(1)
+
+    def test_pattern_hash(self):
+        smokesignal.on('order.#', self.fn)
+        smokesignal.emit('order')
+        smokesignal.emit('order.created')
+        smokesignal.emit('order.created.late')
+        smokesignal.emit('invoice.created')
+        assert self.fn.call_count == 3
+
+    def test_pattern_middle(self):
+        smokesignal.on('*.created.#', self.fn)
+        smokesignal.emit('order.created')
+        smokesignal.emit('invoice.created.late')
+        smokesignal.emit('created')
+        smokesignal.emit('order.updated')
+        assert self.fn.call_count == 2
+
+    def test_pattern_with_exact_receivers(self):
+        calls = []
+        smokesignal.on('order.created', lambda: calls.append('exact'))
+        smokesignal.on('order.*', lambda: calls.append('pattern'))
+        smokesignal.emit('order.created')
+        assert calls == ['exact', 'pattern']
+
+    def test_pattern_calls_callback_once(self):
+        smokesignal.on(('order.created', 'order.*', 'order.#'), self.fn)
+        smokesignal.emit('order.created')
+        assert self.fn.call_count == 1
+
+    def test_pattern_disconnect(self):
+        smokesignal.on('order.*', self.fn)
+        smokesignal.on('order.created', Mock(spec=types.FunctionType))
+        smokesignal.emit('order.updated')
+        smokesignal.disconnect(self.fn)
+
+        smokesignal.emit('order.created')
+        smokesignal.emit('order.updated')
+        assert self.fn.call_count == 1
+        assert not smokesignal._default._patterns
+        assert smokesignal._default._matches == {}
+
+    def test_pattern_memoized(self):
+        smokesignal.on('order.*', self.fn)
+        smokesignal.emit('order.created')
+        with patch.object(smokesignal._PatternTrie, 'match') as match:
+            smokesignal.emit('order.created')
+        assert not match.called
+        assert self.fn.call_count == 2
+
+    def test_pattern_recompiles_matching_plans(self):
+        smokesignal.on('order.created', self.fn)
+        smokesignal.on('user.created', self.fn)
+        bound = smokesignal.signal('order.updated')
+        plans = dict(smokesignal._default._plans)
+
+        pattern = Mock(spec=types.FunctionType)
+        smokesignal.on('order.*', pattern)
+        assert smokesignal._default._plans['user.created'] is plans['user.created']
+        assert smokesignal._default._plans['order.created'] is not plans['order.created']
+        assert bound._plan[0] == (pattern,)
+
+        smokesignal.disconnect(pattern)
+        assert smokesignal._default._plans['order.created'][0] == (self.fn,)
+        assert bound._plan is smokesignal._no_plan
+
+    def test_pattern_once(self):
+        smokesignal.once('order.*', self.fn)
+        smokesignal.emit('order.created')
+        smokesignal.emit('order.updated')
+        assert self.fn.call_count == 1
+        assert smokesignal.receivers == {}
+
+    def test_pattern_clear_all(self):
+        smokesignal.on('order.*', self.fn)
+        smokesignal.clear_all()
+        smokesignal.emit('order.created')
+        assert not self.fn.called
+
+    def test_priority_order(self):
+        calls = []
+        smokesignal.on('foo', lambda: calls.append('low'), priority=-1)
+        smokesignal.on('foo', lambda: calls.append('first'))
+        smokesignal.on('foo', lambda: calls.append('high'), priority=10)
+        smokesignal.on('foo', lambda: calls.append('second'))
+
+        smokesignal.emit('foo')
+        assert calls == ['high', 'first', 'second', 'low']
+
+    def test_priority_change(self):
+        calls = []
+
+        def first():
+            calls.append('first')
+
+        def second():
+            calls.append('second')
+
+        smokesignal.on('foo', first)
+        smokesignal.on('foo', second)
+        smokesignal.on('foo', second, priority=1)
+
+        smokesignal.emit('foo')
+        assert calls == ['second', 'first']
+
+    def test_priority_kept(self):
+        calls = []
+
+        def first():
+            calls.append('first')
+
+        def second():
+            calls.append('second')
+
+        smokesignal.on('foo', first)
+        smokesignal.on('foo', second, priority=1)
+        smokesignal.on('bar', second)
+        smokesignal.on('bar', first)
+
+        smokesignal.emit('foo')
+        smokesignal.emit('bar')
+        assert calls == ['second', 'first', 'second', 'first']
+
+    def test_priority_with_patterns(self):
+        calls = []
+        smokesignal.on('order.created', lambda: calls.append('exact'))
+        smokesignal.on('order.*', lambda: calls.append('pattern'), priority=1)
+
+        smokesignal.emit('order.created')
+        assert calls == ['pattern', 'exact']
+
+    def test_priority_patterns_registration_order(self):
+        calls = []
+        for name in ('a.*', 'a.#', '*.b', '#', 'a.b', '#.b', '*.*', 'a.b.#'):
+            smokesignal.on(name, lambda name=name: calls.append(name))
+
+        smokesignal.emit('a.b')
+        assert calls == ['a.*', 'a.#', '*.b', '#', 'a.b', '#.b', '*.*', 'a.b.#']
+
+    def test_priority_restores_registration_order(self):
+        calls = []
+
+        def first():
+            calls.append('first')
+
+        def second():
+            calls.append('second')
+
+        smokesignal.on('foo', first)
+        smokesignal.on('foo', second)
+        smokesignal.on('foo', second, priority=1)
+        smokesignal.on('foo', second, priority=0)
+
+        smokesignal.emit('foo')
+        assert calls == ['first', 'second']
+
+    def test_match(self):
+        calls = []
+        smokesignal.on('foo', lambda **kw: calls.append('acme'), match={'tenant': 'acme'})
+        smokesignal.on('foo', lambda **kw: calls.append('all'))
+        smokesignal.on('foo', lambda **kw: calls.append('globex'), match={'tenant': 'globex'})
+        smokesignal.on('foo', lambda **kw: calls.append('first'), match={'tenant': 'acme'},
+                       priority=1)
+
+        smokesignal.emit('foo', tenant='acme')
+        assert calls == ['first', 'acme', 'all']
+
+        del calls[:]
+        smokesignal.emit('foo', tenant='initech')
+        smokesignal.emit('foo')
+        smokesignal.emit('foo', tenant=['unhashable'])
+        assert calls == ['all', 'all', 'all']
+
+    def test_match_several_keys(self):
+        smokesignal.on('foo', self.fn, match={'tenant': 'acme', 'region': 'eu'})
+
+        smokesignal.emit('foo', tenant='acme')
+        smokesignal.emit('foo', tenant='acme', region='us')
+        assert not self.fn.called
+
+        smokesignal.emit('foo', 1, region='eu', tenant='acme', user='bob')
+        self.fn.assert_called_once_with(1, region='eu', tenant='acme', user='bob')
+
+    def test_match_predicate(self):
+        calls = []
+        smokesignal.on('foo', lambda n, size: calls.append(n),
+                       match=lambda kwargs: kwargs.get('size', 0) > 10)
+        smokesignal.on('foo', lambda n, size: calls.append('all'))
+
+        smokesignal.emit('foo', 1, size=5)
+        smokesignal.emit('foo', 2, size=50)
+        assert calls == ['all', 2, 'all']
+
+    def test_match_per_signal(self):
+        smokesignal.on('foo', self.fn, match={'tenant': 'acme'})
+        smokesignal.on('bar', self.fn)
+        assert smokesignal._default._plans['bar'][2] is None
+
+        smokesignal.emit('foo', tenant='globex')
+        smokesignal.emit('bar', tenant='globex')
+        assert self.fn.call_count == 1
+
+        # Registering again replaces the filter
+        smokesignal.on('foo', self.fn)
+        assert smokesignal._default._plans['foo'][2] is None
+        smokesignal.emit('foo', tenant='globex')
+        assert self.fn.call_count == 2
+
+    def test_match_patterns_and_signals(self):
+        smokesignal.on('order.*', self.fn, match={'tenant': 'acme'})
+        bound = smokesignal.signal('order.created')
+
+        bound.emit(tenant='globex')
+        smokesignal.emit('order.paid', tenant='globex')
+        assert not self.fn.called
+
+        bound.emit(tenant='acme')
+        smokesignal.emit('order.paid', tenant='acme')
+        assert self.fn.call_count == 2
+
+    def test_match_emit_many_and_results(self):
+        smokesignal.on('foo', lambda n, tenant: n, match={'tenant': 'acme'})
+        smokesignal.on('foo', self.fn, match={'tenant': 'globex'})
+
+        smokesignal.emit_many('foo', [1, 2], tenant='acme')
+        assert smokesignal.emit_results('foo', 3, tenant='acme') == [3]
+        assert not self.fn.called
+
+    def test_match_with_max_calls_and_hooks(self):
+        smokesignal.add_hook(smokesignal.Hook())
+        smokesignal.once('foo', self.fn, match={'tenant': 'acme'})
+
+        smokesignal.emit('foo', tenant='globex')
+        assert smokesignal.responds_to(self.fn, 'foo')
+        smokesignal.emit('foo', tenant='acme')
+        smokesignal.emit('foo', tenant='acme')
+        self.fn.assert_called_once_with(tenant='acme')
+        assert smokesignal.receivers == {}
+
+    def test_match_invalid(self):
+        with pytest.raises(AssertionError):
+            smokesignal.on('foo', self.fn, match='acme')
+
+    def test_match_unhashable(self):
+        smokesignal.on('foo', self.fn, match={'tags': 'a'})
+        with pytest.raises(AssertionError):
+            smokesignal.on('foo', self.fn, match={'tags': ['a']})
+
+        # The earlier registration is left as it was
+        smokesignal.emit('foo', tags='a')
+        self.fn.assert_called_once_with(tags='a')
+
+    def test_throttle(self):
+        now = [100.0]
+        with patch.object(smokesignal, '_monotonic', lambda: now[0]):
+            smokesignal.on('foo', self.fn, throttle=1)
+            for n in range(3):
+                smokesignal.emit('foo', n)
+            now[0] += 1.5
+            smokesignal.emit('foo', 3)
+            smokesignal.emit('foo', 4)
+
+        assert self.fn.call_args_list == [call(0), call(3)]
+
+    def test_throttle_per_signal_with_max_calls(self):
+        now = [100.0]
+        with patch.object(smokesignal, '_monotonic', lambda: now[0]):
+            smokesignal.on('foo', self.fn, throttle=1, max_calls=2)
+            smokesignal.on('bar', self.fn)
+            for n in range(3):
+                smokesignal.emit('foo', n)
+                smokesignal.emit('bar', n)
+                now[0] += 0.4
+
+            # Dropped emissions don't count against the call limit
+            assert smokesignal.responds_to(self.fn, 'foo')
+            now[0] += 1
+            smokesignal.emit('foo', 3)
+            smokesignal.emit('foo', 4)
+
+        assert self.fn.call_count == 5
+        assert smokesignal.signals(self.fn) == ('bar',)
+
+    def test_sample(self):
+        smokesignal.on('foo', self.fn, sample=0.25)
+        for n in range(8):
+            smokesignal.emit('foo', n)
+        assert self.fn.call_args_list == [call(3), call(7)]
+
+    def test_debounce(self):
+        called = threading.Event()
+        self.fn.side_effect = lambda *args, **kwargs: called.set()
+        smokesignal.on('foo', self.fn, debounce=0.05)
+
+        for n in range(3):
+            smokesignal.emit('foo', n, key='value')
+        assert not self.fn.called
+
+        assert called.wait(5)
+        self.fn.assert_called_once_with(2, key='value')
+
+    def test_debounce_disconnect(self):
+        smokesignal.on('foo', self.fn, debounce=0.01)
+        smokesignal.emit('foo')
+        smokesignal.disconnect(self.fn)
+
+        # The timer thread runs calls in order, so a later one running means the
+        # debounced call would have been made by now
+        done = threading.Event()
+        smokesignal._timers.call_later(0.05, done.set)
+        assert done.wait(5)
+        assert not self.fn.called
+
+    def test_rate_invalid(self):
+        for options in ({'throttle': 0}, {'debounce': -1}, {'sample': 1.5}):
+            with pytest.raises(ValueError):
+                smokesignal.on('foo', self.fn, **options)
+
+    def test_timers(self):
+        calls, done = [], threading.Event()
+        smokesignal._timers.call_later(0.02, lambda: calls.append('second'))
+        smokesignal._timers.call_later(0.01, lambda: calls.append('first'))
+        smokesignal._timers.call_later(0.01, lambda: calls.append('cancelled')).cancel()
+        smokesignal._timers.call_later(0.03, done.set)
+
+        assert done.wait(5)
+        assert calls == ['first', 'second']
+
+    def test_stop_propagation(self):
+        def stop():
+            raise smokesignal.StopPropagation()
+
+        smokesignal.on('foo', stop, priority=1)
+        smokesignal.on('foo', self.fn)
+
+        smokesignal.emit('foo')
+        assert not self.fn.called
+
+    def test_stop_propagation_routed(self):
+        def stop():
+            raise smokesignal.StopPropagation()
+
+        smokesignal.once('foo', stop, priority=1)
+        smokesignal.on('foo', self.fn)
+
+        smokesignal.emit('foo')
+        assert not self.fn.called
+
+        smokesignal.emit('foo')
+        assert self.fn.called
+
+    def test_emit_many_stop_propagation(self):
+        def stop_odd(n):
+            if n % 2:
+                raise smokesignal.StopPropagation()
+
+        smokesignal.on('foo', stop_odd, priority=1)
+        smokesignal.on('foo', self.fn)
+
+        smokesignal.emit_many('foo', range(5))
+        assert self.fn.call_args_list == [call(0), call(2), call(4)]
+
+    def test_emit_many_stop_propagation_batch(self):
+        def stop(payloads):
+            raise smokesignal.StopPropagation()
+
+        smokesignal.on('foo', stop, batch=True, priority=1)
+        smokesignal.on('foo', self.fn)
+
+        smokesignal.emit_many('foo', range(5))
+        assert not self.fn.called
+
+    @pytest.mark.skipif(ThreadPoolExecutor is None, reason='requires concurrent.futures')
+    def test_emit_futures_stop_propagation(self):
+        def stop():
+            raise smokesignal.StopPropagation()
+
+        smokesignal.on('foo', lambda: 'first', priority=1)
+        smokesignal.on('foo', stop)
+        smokesignal.on('foo', self.fn)
+
+        futures = smokesignal.emit_futures('foo')
+        assert [f.result() for f in futures] == ['first']
+        assert not self.fn.called
+
+    def test_plans_uninstrumented_without_hooks(self):
+        smokesignal.on('foo', self.fn)
+        assert smokesignal._default._plans['foo'] == ((self.fn,), None, None)
+        assert type(smokesignal._default._plans['foo'][0][0]) is not smokesignal._Instrumented
+
+    def test_hooks(self):
+        hook = Mock(spec=smokesignal.Hook)
+        smokesignal.on('foo', self.fn)
+        smokesignal.emit('foo')
+
+        smokesignal.add_hook(hook)
+        smokesignal.emit('foo', 1, bar=2)
+        hook.pre_dispatch.assert_called_once_with('foo', self.fn, (1,), {'bar': 2})
+        signal, callback, elapsed, error = hook.post_dispatch.call_args[0]
+        assert (signal, callback, error) == ('foo', self.fn, None)
+        assert elapsed >= 0
+
+        smokesignal.remove_hook(hook)
+        smokesignal.emit('foo')
+        assert hook.pre_dispatch.call_count == 1
+        assert smokesignal._default._plans['foo'] == ((self.fn,), None, None)
+
+    def test_hooks_error(self):
+        hook = Mock(spec=smokesignal.Hook)
+        self.fn.side_effect = ValueError
+        smokesignal.on('foo', self.fn)
+        smokesignal.add_hook(hook)
+
+        try:
+            smokesignal.emit('foo')
+        except ValueError:
+            pass
+        assert isinstance(hook.post_dispatch.call_args[0][3], ValueError)
+
+    def test_hooks_max_calls(self):
+        smokesignal.add_hook(smokesignal.Hook())
+        smokesignal.on('foo', self.fn, max_calls=2)
+
+        for x in range(5):
+            smokesignal.emit('foo')
+        assert self.fn.call_count == 2
+        assert smokesignal.receivers == {}
+
+    def test_hooks_patterns(self):
+        hook = Mock(spec=smokesignal.Hook)
+        smokesignal.add_hook(hook)
+        smokesignal.on('order.*', self.fn)
+
+        smokesignal.emit('order.created')
+        assert hook.pre_dispatch.call_args[0][:2] == ('order.created', self.fn)
+
+    def test_instrument(self):
+        assert smokesignal.stats() == {}
+        smokesignal.on('foo', self.fn)
+        assert isinstance(smokesignal.instrument(), smokesignal.Stats)
+
+        for x in range(3):
+            smokesignal.emit('foo')
+
+        entry = smokesignal.stats()[('foo', self.fn)]
+        assert entry['calls'] == 3
+        assert entry['errors'] == 0
+        assert 0 < entry['p50'] <= entry['p99']
+
+        assert smokesignal.instrument(False) is None
+        assert smokesignal.stats() == {}
+        assert smokesignal._hooks == ()
+
+    def test_stats_errors_and_percentiles(self):
+        stats = smokesignal.Stats()
+        for x in range(98):
+            stats.post_dispatch('foo', square, 0.000003, None)
+        stats.post_dispatch('foo', square, 0.001, None)
+        stats.post_dispatch('foo', square, 0.001, ValueError())
+
+        entry = stats.snapshot()[('foo', square)]
+        assert entry['calls'] == 100
+        assert entry['errors'] == 1
+        assert entry['p50'] == 0.000004
+        assert entry['p99'] == 0.001024
+
+        stats.reset()
+        assert stats.snapshot() == {}
+
+    def test_dispatchers_are_independent(self):
+        bus = smokesignal.Dispatcher()
+        other = Mock(spec=types.FunctionType)
+        bus.on('foo', self.fn)
+        smokesignal.on('foo', other)
+
+        bus.emit('foo', 1)
+        self.fn.assert_called_once_with(1)
+        assert not other.called
+
+        bus.clear()
+        assert bus.receivers == {}
+        assert smokesignal.receivers == {'foo': (other,)}
+
+    def test_dispatcher_once(self):
+        bus = smokesignal.Dispatcher()
+        bus.once('foo', self.fn)
+        bus.emit('foo')
+        bus.emit('foo')
+        assert self.fn.call_count == 1
+        assert bus.receivers == {}
+
+    def test_dispatcher_weak(self):
+        class Listener(object):
+            def __call__(self):
+                pass
+
+        bus = smokesignal.Dispatcher()
+        listener = Listener()
+        bus.on('foo', listener, weak=True)
+        del listener
+        gc.collect()
+        assert bus.receivers == {}
+
+    def test_dispatcher_hooks(self):
+        hook = Mock(spec=smokesignal.Hook)
+        bus = smokesignal.Dispatcher()
+        bus.on('foo', self.fn)
+
+        smokesignal.add_hook(hook)
+        bus.emit('foo')
+        assert hook.pre_dispatch.call_args[0][:2] == ('foo', self.fn)
+
+        smokesignal.remove_hook(hook)
+        assert bus._plans['foo'] == ((self.fn,), None, None)
+
+    def test_signal_object(self):
+        foo = smokesignal.signal('foo')
+        assert smokesignal.signal('foo') is foo
+
+        foo.emit()
+        foo.on(self.fn)
+        assert foo.receivers == (self.fn,)
+
+        foo.emit(1)
+        self.fn.assert_called_once_with(1)
+
+        foo.disconnect(self.fn)
+        foo.emit(2)
+        assert self.fn.call_count == 1
+
+    def test_signal_object_max_calls(self):
+        foo = smokesignal.signal('foo')
+        foo.once(self.fn)
+        foo.emit()
+        foo.emit()
+        assert self.fn.call_count == 1
+        assert foo.receivers == ()
+
+    def test_signal_object_patterns(self):
+        created = smokesignal.signal('order.created')
+        smokesignal.on('order.*', self.fn)
+        created.emit(1)
+        self.fn.assert_called_once_with(1)
+
+        smokesignal.clear('order.*')
+        created.emit(2)
+        assert self.fn.call_count == 1
+
+    def test_signal_object_clear_all(self):
+        foo = smokesignal.signal('foo')
+        foo.on(self.fn)
+        smokesignal.clear_all()
+        foo.emit()
+        assert not self.fn.called
+
+    def test_signal_object_decorator(self):
+        bus = smokesignal.Dispatcher()
+        foo = bus.signal('foo')
+
+        @foo.on
+        def callback(n):
+            return n
+
+        assert foo.receivers == (callback,)
+        assert smokesignal.receivers == {}
+
+    def test_buffered_signal_dispatcher(self):
+        bus = smokesignal.Dispatcher()
+        bus.on('foo', self.fn)
+        buffered = smokesignal.BufferedSignal('foo', dispatcher=bus)
+        buffered.emit(1)
+        assert buffered.flush() == 1
+        self.fn.assert_called_once_with(1)
+
+    def test_has_receivers(self):
+        assert not smokesignal.has_receivers('foo')
+        smokesignal.on('foo', self.fn)
+        assert smokesignal.has_receivers('foo')
+        assert not smokesignal.has_receivers('bar')
+        assert 'bar' not in smokesignal.receivers
+
+    def test_has_receivers_patterns(self):
+        smokesignal.on('order.*', self.fn)
+        assert smokesignal.has_receivers('order.created')
+        assert not smokesignal.has_receivers('user.created')
+
+    def test_has_receivers_match(self):
+        smokesignal.on('foo', self.fn, match={'level': 'error'})
+        assert smokesignal.has_receivers('foo', level='error')
+        assert not smokesignal.has_receivers('foo', level='info')
+        assert not smokesignal.has_receivers('foo')
+
+        foo = smokesignal.signal('foo')
+        assert foo.has_receivers(level='error')
+        assert not foo.has_receivers(level='info')
+
+    def test_emit_lazy(self):
+        backend = smokesignal._backend
+        try:
+            smokesignal.set_backend('sync')
+            factory = Mock(return_value={'id': 1})
+            assert smokesignal.emit_lazy('foo', factory) is None
+            assert not factory.called
+
+            smokesignal.on('foo', self.fn)
+            smokesignal.emit_lazy('foo', factory, bar=2)
+            self.fn.assert_called_once_with({'id': 1}, bar=2)
+        finally:
+            smokesignal.set_backend(backend)
+
+    def test_emit_lazy_match(self):
+        factory = Mock(return_value=1)
+        smokesignal.on('foo', self.fn, match={'level': 'error'})
+        foo = smokesignal.signal('foo')
+
+        smokesignal.emit_lazy('foo', factory, level='info')
+        foo.emit_lazy(factory, level='info')
+        assert not factory.called
+
+        foo.emit_lazy(factory, level='error')
+        self.fn.assert_called_once_with(1, level='error')
+
+    def test_signal_object_emit_lazy(self):
+        backend = smokesignal._backend
+        try:
+            smokesignal.set_backend('sync')
+            factory = Mock(return_value=1)
+            foo = smokesignal.signal('foo')
+            assert not foo.has_receivers()
+            assert foo.emit_lazy(factory) is None
+            assert not factory.called
+
+            foo.on(self.fn)
+            assert foo.has_receivers()
+            foo.emit_lazy(factory)
+            self.fn.assert_called_once_with(1)
+        finally:
+            smokesignal.set_backend(backend)
+
+    def _blocked_background(self, policy, maxsize=2):
+        """
+        Returns a background dispatcher whose only worker is stuck on the first
+        emission of 'foo' until the returned event is set
+        """
+        started, release = threading.Event(), threading.Event()
+
+        def block(n):
+            if n == 0:
+                started.set()
+                release.wait(5)
+
+        smokesignal.on('foo', block)
+        smokesignal.on('foo', self.fn)
+        background = smokesignal.BackgroundDispatcher(maxsize=maxsize, policy=policy)
+        background.emit('foo', 0)
+        assert started.wait(5)
+        return background, release
+
+    def test_background_emit(self):
+        smokesignal.on('foo', self.fn)
+        with smokesignal.BackgroundDispatcher(workers=2) as background:
+            for x in range(10):
+                assert background.emit('foo', x)
+            assert background.drain(5)
+
+        assert sorted(c[0][0] for c in self.fn.call_args_list) == list(range(10))
+        assert background.emitted == 10
+        assert background.depth == 0
+
+    def test_background_max_calls(self):
+        smokesignal.on('foo', self.fn, max_calls=3)
+        background = smokesignal.BackgroundDispatcher(workers=4)
+        for x in range(20):
+            background.emit('foo')
+        assert background.close(5)
+        assert self.fn.call_count == 3
+        assert smokesignal.receivers == {}
+
+    def test_background_drop_newest(self):
+        background, release = self._blocked_background('drop_newest')
+        results = [background.emit('foo', x) for x in range(1, 5)]
+        assert results == [True, True, False, False]
+        assert background.dropped == 2
+        assert background.max_depth == 2
+
+        release.set()
+        assert background.close(5)
+        assert self.fn.call_args_list == [call(0), call(1), call(2)]
+
+    def test_background_drop_oldest(self):
+        background, release = self._blocked_background('drop_oldest')
+        for x in range(1, 5):
+            assert background.emit('foo', x)
+        assert background.dropped == 2
+
+        release.set()
+        assert background.close(5)
+        assert self.fn.call_args_list == [call(0), call(3), call(4)]
+
+    def test_background_inline(self):
+        background, release = self._blocked_background('inline', maxsize=1)
+        background.emit('foo', 1)
+        background.emit('foo', 2)
+        assert background.inline == 1
+        assert self.fn.call_args_list == [call(2)]
+
+        release.set()
+        assert background.close(5)
+        assert self.fn.call_args_list == [call(2), call(0), call(1)]
+
+    def test_background_block(self):
+        background, release = self._blocked_background('block', maxsize=1)
+        background.emit('foo', 1)
+
+        emitter = threading.Thread(target=background.emit, args=('foo', 2))
+        emitter.start()
+        emitter.join(0.05)
+        assert emitter.is_alive()
+
+        release.set()
+        emitter.join(5)
+        assert background.close(5)
+        assert self.fn.call_args_list == [call(0), call(1), call(2)]
+
+    def test_background_drain_timeout(self):
+        background, release = self._blocked_background('block')
+        assert not background.drain(0.01)
+        release.set()
+        assert background.drain(5)
+        background.close()
+
+    def test_background_errors(self):
+        self.fn.side_effect = ValueError
+        background = smokesignal.BackgroundDispatcher(dispatcher=smokesignal.Dispatcher())
+        background.dispatcher.on('foo', self.fn)
+        with patch.object(smokesignal, '_log') as log:
+            background.emit('foo')
+            background.close(5)
+        assert background.errors == 1
+        assert log.exception.call_count == 1
+
+    def test_background_close_timeout(self):
+        release = threading.Event()
+        background = smokesignal.BackgroundDispatcher(dispatcher=smokesignal.Dispatcher())
+        background.dispatcher.on('foo', lambda: release.wait(5))
+        background.emit('foo')
+        background.emit('foo')
+        assert not background.close(0.05)
+
+        # The emission dropped by closing isn't waited for
+        release.set()
+        assert background.drain(5)
+
+    def test_background_closed(self):
+        background = smokesignal.BackgroundDispatcher()
+        background.close()
+        with pytest.raises(RuntimeError):
+            background.emit('foo')
+
+    def test_background_bad_policy(self):
+        with pytest.raises(ValueError):
+            smokesignal.BackgroundDispatcher(policy='ignore')
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus(self):
+        path = tempfile.mkdtemp()
+        try:
+            first, second = smokesignal.Dispatcher(), smokesignal.Dispatcher()
+            local = Mock(spec=types.FunctionType)
+            first.on('cache', local)
+
+            with smokesignal.ProcessBus(path, 'cache', first, name='first') as a, \
+                    smokesignal.ProcessBus(path, 'cache', second, name='second') as b:
+                received = threading.Event()
+                self.fn.side_effect = lambda *args, **kwargs: received.set()
+                second.on('cache', self.fn)
+
+                first.emit('cache', 'user:1', reason='saved')
+                assert received.wait(5)
+                self.fn.assert_called_once_with('user:1', reason='saved')
+                local.assert_called_once_with('user:1', reason='saved')
+
+                # Received emissions aren't published back
+                assert a.flush(5) and b.flush(5)
+                assert (a.published, b.published) == (1, 0)
+                assert a.peers() == [b.address]
+
+            assert os.listdir(path) == []
+        finally:
+            shutil.rmtree(path)
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus_batches(self):
+        path = tempfile.mkdtemp()
+        try:
+            dispatcher = smokesignal.Dispatcher()
+            received, done = [], threading.Event()
+
+            def receive(n):
+                received.append(n)
+                if len(received) == 100:
+                    done.set()
+
+            dispatcher.on('cache', receive)
+            with smokesignal.ProcessBus(path, 'cache', name='first') as a, \
+                    smokesignal.ProcessBus(path, 'cache', dispatcher, name='second'):
+                for n in range(100):
+                    a.publish('cache', n)
+                assert done.wait(5)
+            assert received == list(range(100))
+        finally:
+            shutil.rmtree(path)
+
+    def test_process_bus_datagrams(self):
+        frames = [b'x' * 40000, b'y' * 20000, b'z' * 10000, b'!']
+        assert list(smokesignal._datagrams(frames)) == [frames[0] + frames[1],
+                                                         frames[2] + frames[3]]
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus_stale_peer(self):
+        path = tempfile.mkdtemp()
+        try:
+            stale = os.path.join(path, 'gone.sock')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(stale)
+            sock.close()
+
+            with smokesignal.ProcessBus(path, 'cache') as bus:
+                bus.publish('cache', 1)
+                assert bus.flush(5)
+                assert not os.path.exists(stale)
+                assert bus.errors == 0
+        finally:
+            shutil.rmtree(path)
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus_invalid(self):
+        path = tempfile.mkdtemp()
+        try:
+            with pytest.raises(ValueError):
+                smokesignal.ProcessBus(path, ['cache.*'])
+
+            bus = smokesignal.ProcessBus(path, ['cache'])
+            with pytest.raises(ValueError):
+                bus.publish('cache', b'x' * 100000)
+            bus.close()
+
+            with pytest.raises(RuntimeError):
+                bus.publish('cache', 1)
+            assert not smokesignal.has_receivers('cache')
+        finally:
+            shutil.rmtree(path)
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus_insecure_directory(self):
+        path = tempfile.mkdtemp()
+        try:
+            os.chmod(path, 0o777)
+            with pytest.raises(ValueError):
+                smokesignal.ProcessBus(path, ['cache'])
+            assert os.listdir(path) == []
+        finally:
+            shutil.rmtree(path)
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+    def test_process_bus_errors(self):
+        path = tempfile.mkdtemp()
+        try:
+            dispatcher = smokesignal.Dispatcher()
+            self.fn.side_effect = ValueError
+            dispatcher.on('cache', self.fn)
+
+            logged = threading.Event()
+            with patch.object(smokesignal, '_log') as log:
+                log.exception.side_effect = lambda *args: logged.set()
+                with smokesignal.ProcessBus(path, 'cache', name='first') as a, \
+                        smokesignal.ProcessBus(path, 'cache', dispatcher, name='second') as b:
+                    a.publish('cache', 1)
+                    assert logged.wait(5)
+            self.fn.assert_called_once_with(1)
+            assert (b.received, b.errors) == (1, 1)
+        finally:
+            shutil.rmtree(path)
+
+    def _failing_emit(self, policy):
+        """
+        Returns a dispatcher with the given error policy, and 'foo' registered to a
+        failing callback between two working ones
+        """
+        bus = smokesignal.Dispatcher(error_policy=policy)
+        self.failure = Mock(side_effect=ValueError('boom'))
+        self.last = Mock()
+        bus.on('foo', self.fn)
+        bus.on('foo', self.failure)
+        bus.on('foo', self.last)
+        return bus
+
+    @pytest.mark.skipif(smokesignal._twisted_support, reason='emit returns deferreds')
+    def test_error_policy_raise(self):
+        bus = self._failing_emit('raise')
+        with pytest.raises(ValueError):
+            bus.emit('foo')
+        assert not self.last.called
+
+    @pytest.mark.skipif(smokesignal._twisted_support, reason='emit returns deferreds')
+    def test_error_policy_group(self):
+        bus = self._failing_emit('group')
+        with pytest.raises(smokesignal.EmitError) as e:
+            bus.emit('foo', 1)
+        assert [c for c, error in e.value.failures] == [self.failure]
+        assert str(e.value.failures[0][1]) == 'boom'
+        self.last.assert_called_once_with(1)
+
+    @pytest.mark.skipif(smokesignal._twisted_support, reason='emit returns deferreds')
+    def test_error_policy_log(self):
+        bus = self._failing_emit('log')
+        with patch.object(smokesignal, '_log') as log:
+            bus.emit('foo', 1)
+            bus.signal('foo').emit(2)
+        assert log.error.call_count == 2
+        assert self.last.call_args_list == [call(1), call(2)]
+
+    @pytest.mark.skipif(smokesignal._twisted_support, reason='emit returns deferreds')
+    def test_error_policy_group_bound_signal(self):
+        bus = self._failing_emit('group')
+        with pytest.raises(smokesignal.EmitError):
+            bus.signal('foo').emit()
+        assert self.last.called
+
+    @pytest.mark.skipif(smokesignal._twisted_support, reason='emit returns deferreds')
+    def test_error_policy_routed(self):
+        bus = self._failing_emit('log')
+        bus.once('foo', self.failure)
+        with patch.object(smokesignal, '_log'):
+            bus.emit('foo')
+            bus.emit('foo')
+        assert self.failure.call_count == 1
+        assert self.last.call_count == 2
+
+    def test_error_policy_emit_many(self):
+        bus = self._failing_emit('group')
+        with pytest.raises(smokesignal.EmitError) as e:
+            bus.emit_many('foo', [1, 2])
+        assert len(e.value.failures) == 2
+        assert self.last.call_args_list == [call(1), call(2)]
+
+    def test_error_policy_emit_many_batch(self):
+        bus = self._failing_emit('log')
+        bus.on('foo', self.failure, batch=True)
+        with patch.object(smokesignal, '_log') as log:
+            bus.emit_many('foo', [1, 2])
+        assert log.error.call_count == 1
+        assert self.last.call_args_list == [call(1), call(2)]
+
+    def test_circuit_breaker(self):
+        bus = self._failing_emit(smokesignal.CircuitBreaker(failures=3, window=10))
+        with patch.object(smokesignal, '_log'):
+            for x in range(5):
+                bus.emit_many('foo', [x])
+        assert self.failure.call_count == 3
+        assert not bus.responds_to(self.failure, 'foo')
+        assert self.last.call_count == 5
+
+    def test_circuit_breaker_window(self):
+        breaker = smokesignal.CircuitBreaker(failures=2, window=10)
+        bus = smokesignal.Dispatcher()
+        bus.on('foo', self.fn)
+
+        with patch.object(smokesignal, '_clock', side_effect=[0, 20, 25]), \
+                patch.object(smokesignal, '_log'):
+            assert not breaker.failed(bus, self.fn)
+            assert not breaker.failed(bus, self.fn)
+            assert breaker.failed(bus, self.fn)
+        assert bus.receivers == {}
+
+    def test_circuit_breaker_forgets(self):
+        breaker = smokesignal.CircuitBreaker(failures=2, window=10)
+        other = Mock(spec=types.FunctionType)
+        bus = smokesignal.Dispatcher()
+
+        with patch.object(smokesignal, '_clock', side_effect=[0, 20]):
+            assert not breaker.failed(bus, self.fn)
+            assert not breaker.failed(bus, other)
+        assert list(breaker._recent) == [(bus, other)]
+
+    def test_circuit_breaker_per_dispatcher(self):
+        breaker = smokesignal.CircuitBreaker(failures=2, window=10)
+        bus = smokesignal.Dispatcher()
+        other = smokesignal.Dispatcher()
+        bus.on('foo', self.fn)
+        other.on('foo', self.fn)
+
+        with patch.object(smokesignal, '_log'):
+            assert not breaker.failed(bus, self.fn)
+            assert not breaker.failed(other, self.fn)
+            assert breaker.failed(bus, self.fn)
+        assert not bus.responds_to(self.fn, 'foo')
+        assert other.responds_to(self.fn, 'foo')
+
+    def test_error_policy_invalid(self):
+        with pytest.raises(ValueError):
+            smokesignal.Dispatcher(error_policy='ignore')
+        with pytest.raises(ValueError):
+            smokesignal.set_error_policy('ignore')
+        assert smokesignal._default.error_policy == 'raise'
+
+    def test_emit_results(self):
+        smokesignal.on('foo', lambda n: n + 1)
+        smokesignal.on('foo', lambda n: n + 2, priority=1)
+        assert smokesignal.emit_results('foo', 1) == [3, 2]
+        assert smokesignal.emit_results('bar') == []
+
+    def test_emit_reduce_any_short_circuits(self):
+        smokesignal.on('foo', lambda: False)
+        smokesignal.on('foo', lambda: True)
+        smokesignal.on('foo', self.fn)
+
+        assert smokesignal.emit_reduce('foo', any) is True
+        assert not self.fn.called
+
+    def test_emit_reduce_all_short_circuits(self):
+        smokesignal.on('foo', lambda: True)
+        smokesignal.on('foo', lambda: False)
+        smokesignal.on('foo', self.fn)
+
+        assert smokesignal.emit_reduce('foo', all) is False
+        assert not self.fn.called
+
+    def test_emit_reduce_first_non_none(self):
+        smokesignal.on('foo', lambda n: None)
+        smokesignal.on('foo', lambda n: n * 2)
+        smokesignal.on('foo', self.fn)
+
+        assert smokesignal.emit_reduce('foo', smokesignal.first_non_none, 21) == 42
+        assert not self.fn.called
+        assert smokesignal.emit_reduce('bar', smokesignal.first_non_none) is None
+
+    def test_emit_reduce_max_calls(self):
+        smokesignal.once('foo', lambda: False)
+        smokesignal.on('foo', lambda: True)
+        assert smokesignal.emit_results('foo') == [False, True]
+        assert smokesignal.emit_results('foo') == [True]
+
+    def test_emit_reduce_batch(self):
+        smokesignal.on('foo', lambda payloads: len(payloads), batch=True)
+        assert smokesignal.emit_results('foo', 1, 2, 3) == [3]
+
+    def test_emit_reduce_stop_propagation(self):
+        def stop():
+            raise smokesignal.StopPropagation()
+
+        smokesignal.on('foo', lambda: 'first', priority=1)
+        smokesignal.on('foo', stop)
+        smokesignal.on('foo', self.fn)
+        assert smokesignal.emit_results('foo') == ['first']
+        assert not self.fn.called
+
+    def test_emit_reduce_errors(self):
+        bus = self._failing_emit('raise')
+        with pytest.raises(ValueError):
+            bus.emit_results('foo')
+
+        bus.set_error_policy('log')
+        with patch.object(smokesignal, '_log'):
+            assert len(bus.emit_results('foo')) == 2
+
+        bus.set_error_policy('group')
+        with pytest.raises(smokesignal.EmitError):
+            bus.emit_results('foo')
+
+    def test_set_backend_sync(self):
+        backend = smokesignal._backend
+        try:
+            assert smokesignal.set_backend('sync')
+            assert smokesignal.Dispatcher.emit == smokesignal.Dispatcher._emit_sync
+            assert smokesignal.Signal.emit == smokesignal.Signal._emit_sync
+
+            smokesignal.on('foo', self.fn)
+            assert smokesignal.emit('foo', 1) is None
+            assert smokesignal.signal('foo').emit(2) is None
+            assert self.fn.call_args_list == [call(1), call(2)]
+        finally:
+            smokesignal.set_backend(backend)
+
+    def test_set_backend_unknown(self):
+        with pytest.raises(ValueError):
+            smokesignal.set_backend('gevent')
+
+    def test_set_backend_auto(self):
+        backend = smokesignal._backend
+        try:
+            with patch.dict(sys.modules, {'twisted.internet.defer': None}):
+                smokesignal.set_backend('auto')
+                assert smokesignal.Dispatcher.emit == smokesignal.Dispatcher._emit_auto
+
+                smokesignal.on('foo', self.fn)
+                smokesignal.signal('foo').emit(1)
+            assert smokesignal._backend == 'sync'
+            assert smokesignal.Dispatcher.emit == smokesignal.Dispatcher._emit_sync
+            self.fn.assert_called_once_with(1)
+        finally:
+            smokesignal.set_backend(backend)
+
+    def test_set_backend_auto_captured_emit(self):
+        backend = smokesignal._backend
+        try:
+            smokesignal.set_backend('auto')
+            emit = smokesignal.emit
+            smokesignal.set_backend('sync')
+            smokesignal.on('foo', self.fn)
+
+            # Twisted being imported doesn't take over from the backend chosen
+            with patch.dict(sys.modules, {'twisted.internet.defer': Mock()}):
+                assert emit('foo', 1) is None
+            assert smokesignal._backend == 'sync'
+            self.fn.assert_called_once_with(1)
+        finally:
+            smokesignal.set_backend(backend)
+
+    def test_import_does_not_import_twisted(self):
+        code = 'import sys, smokesignal; assert "twisted" not in sys.modules'
+        cwd = os.path.dirname(os.path.abspath(smokesignal.__file__))
+        assert subprocess.call([sys.executable, '-c', code], cwd=cwd) == 0
+
+    def test_import_does_not_import_logging(self):
+        code = 'import sys, smokesignal; assert "logging" not in sys.modules'
+        cwd = os.path.dirname(os.path.abspath(smokesignal.__file__))
+        assert subprocess.call([sys.executable, '-c', code], cwd=cwd) == 0
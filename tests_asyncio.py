@@ -0,0 +1,194 @@
+"""
+With asyncio available, test asyncio support in smokesignal
+"""
+import asyncio
+import unittest
+
+from mock import patch
+
+import smokesignal
+
+
+class TestAsyncio(unittest.TestCase):
+    def setUp(self):
+        patch.object(smokesignal, '_hooks', ()).start()
+        patch.object(smokesignal, '_stats', None).start()
+        smokesignal.clear_all()
+
+    def tearDown(self):
+        smokesignal.clear_all()
+        smokesignal.set_error_policy('raise')
+        patch.stopall()
+
+    def test_results_in_order(self):
+        """
+        Synchronous and coroutine results are gathered in call order
+        """
+        async def first(n):
+            await asyncio.sleep(0.01)
+            return n + 1
+
+        def second(n):
+            return n + 2
+
+        async def third(n):
+            return n + 3
+
+        smokesignal.on('foo', first)
+        smokesignal.on('foo', second)
+        smokesignal.on('foo', third)
+
+        results = asyncio.run(self._emit('foo', 10))
+        assert results == [11, 12, 13]
+
+    def test_no_callbacks(self):
+        assert asyncio.run(self._emit('foo')) == []
+
+    def test_concurrent(self):
+        """
+        Coroutines run concurrently rather than one after another
+        """
+        event = asyncio.Event()
+
+        async def waiter():
+            await event.wait()
+            return 'waited'
+
+        async def setter():
+            event.set()
+            return 'set'
+
+        smokesignal.on('foo', waiter)
+        smokesignal.on('foo', setter)
+
+        results = asyncio.run(self._emit('foo', timeout=1))
+        assert results == ['waited', 'set']
+
+    def test_max_calls(self):
+        calls = []
+
+        async def cb():
+            calls.append(1)
+
+        smokesignal.on('foo', cb, max_calls=2)
+
+        async def emit_many():
+            for x in range(5):
+                await smokesignal.emit_async('foo')
+
+        asyncio.run(emit_many())
+        assert len(calls) == 2
+        assert smokesignal.receivers == {}
+
+    def test_timeout(self):
+        async def slow():
+            await asyncio.sleep(10)
+
+        smokesignal.on('foo', slow)
+
+        results = asyncio.run(self._emit('foo', timeout=0.01, return_exceptions=True))
+        assert len(results) == 1
+        assert isinstance(results[0], asyncio.TimeoutError)
+
+    def test_return_exceptions(self):
+        def sync_failure():
+            1/0
+
+        async def async_failure():
+            {}['key_error']
+
+        def ok():
+            return 'ok'
+
+        smokesignal.on('foo', sync_failure)
+        smokesignal.on('foo', async_failure)
+        smokesignal.on('foo', ok)
+
+        results = asyncio.run(self._emit('foo', return_exceptions=True))
+        assert isinstance(results[0], ZeroDivisionError)
+        assert isinstance(results[1], KeyError)
+        assert results[2] == 'ok'
+
+    def test_raises_first_exception(self):
+        def sync_failure():
+            1/0
+
+        smokesignal.on('foo', sync_failure)
+
+        with self.assertRaises(ZeroDivisionError):
+            asyncio.run(self._emit('foo'))
+
+    def test_error_policy_log(self):
+        def sync_failure():
+            1/0
+
+        async def async_failure():
+            {}['key_error']
+
+        smokesignal.on('foo', sync_failure)
+        smokesignal.on('foo', async_failure)
+        smokesignal.on('foo', lambda: 'ok')
+
+        smokesignal.set_error_policy('log')
+        with patch.object(smokesignal, '_log') as log:
+            assert asyncio.run(self._emit('foo')) == [None, None, 'ok']
+        assert log.error.call_count == 2
+
+    def test_error_policy_group(self):
+        def sync_failure():
+            1/0
+
+        smokesignal.on('foo', sync_failure)
+        smokesignal.on('foo', lambda: 'ok')
+
+        smokesignal.set_error_policy('group')
+        with self.assertRaises(smokesignal.EmitError) as e:
+            asyncio.run(self._emit('foo'))
+        assert isinstance(e.exception.failures[0][1], ZeroDivisionError)
+
+    def test_stop_propagation(self):
+        def stop():
+            raise smokesignal.StopPropagation()
+
+        async def first():
+            return 'first'
+
+        async def last():
+            return 'last'
+
+        smokesignal.on('foo', first, priority=2)
+        smokesignal.on('foo', stop, priority=1)
+        smokesignal.on('foo', last)
+
+        assert asyncio.run(self._emit('foo')) == ['first']
+
+    def test_no_running_loop(self):
+        smokesignal.on('foo', lambda: None)
+        with self.assertRaises(RuntimeError):
+            smokesignal.emit_async('foo')
+
+    def test_install_asyncio(self):
+        self.addCleanup(smokesignal.set_backend, smokesignal._backend)
+        assert smokesignal.install_asyncio()
+        assert smokesignal.emit == smokesignal.emit_async
+        assert smokesignal.Dispatcher.emit == smokesignal.Dispatcher.emit_async
+        assert smokesignal.Signal.emit == smokesignal.Signal._relay
+        assert smokesignal._backend == 'asyncio'
+
+    def test_emit_lazy_unheard(self):
+        """
+        With nothing responding, emit_lazy still returns an awaitable of no results
+        """
+        self.addCleanup(smokesignal.set_backend, smokesignal._backend)
+        smokesignal.install_asyncio()
+        factory = lambda: self.fail('the payload was built')
+        smokesignal.on('foo', lambda n, level: None, match={'level': 'error'})
+
+        async def emit():
+            return (await smokesignal.emit_lazy('foo', factory, level='info'),
+                    await smokesignal.signal('foo').emit_lazy(factory, level='info'))
+
+        assert asyncio.run(emit()) == ([], [])
+
+    async def _emit(self, signal, *args, **kwargs):
+        return await smokesignal.emit_async(signal, *args, **kwargs)
@@ -3,14 +3,19 @@ With Twisted available, test optional Twisted support in smokesignal
 """
 
 from twisted.internet import reactor, defer, task
+from twisted.python import failure
 from twisted.trial import unittest
 
 from mock import patch
 
 import smokesignal
 
+smokesignal.install_twisted()
 
 class TestTwisted(unittest.TestCase):
+    def tearDown(self):
+        smokesignal.clear_all()
+
     def _emit(self, expectSuccess=None, expectFailure=None):
         """
         Fire a signal and compare results to expectations
@@ -33,7 +38,7 @@ class TestTwisted(unittest.TestCase):
 
     def test_max_calls(self):
         """
-        Do I decrement _max_calls immediately when the function is called,
+        Do I claim one of the max_calls immediately when the function is called,
         even when I'm passing through a reactor loop?
 
         Discussion: In a naive implementation, max_calls was handled when the
@@ -49,11 +54,26 @@ class TestTwisted(unittest.TestCase):
 
         smokesignal.on('19', cb, max_calls=19)
         d1 = smokesignal.emit('19')
-        assert list(smokesignal.receivers['19'])[0]._max_calls == 18
+        assert smokesignal._default._budgets[('19', cb)] == 18
         d2 = smokesignal.emit('19')
-        assert list(smokesignal.receivers['19'])[0]._max_calls == 17
+        assert smokesignal._default._budgets[('19', cb)] == 17
         return defer.DeferredList([d1, d2])
 
+    def test_stop_propagation(self):
+        """
+        Callbacks that synchronously raise StopPropagation keep the signal from
+        later callbacks, and are left out of the results
+        """
+        def stop(target):
+            raise smokesignal.StopPropagation()
+
+        smokesignal.on('hello', synchronous, priority=2)
+        smokesignal.on('hello', stop, priority=1)
+        smokesignal.on('hello', synchronous_failure)
+        d = self._emit(expectSuccess='synchronous done')
+        smokesignal.clear('hello')
+        return d
+
     def test_synchronous(self):
         """
         Blocking callbacks should simply fire the deferred
@@ -84,6 +104,75 @@ class TestTwisted(unittest.TestCase):
         smokesignal.once('hello', asynchronous_failure)
         return self._emit(expectFailure=KeyError)
 
+    def test_error_policy_log(self):
+        """
+        Under the log policy, failures are logged and their results become None
+        """
+        bus = smokesignal.Dispatcher(error_policy='log')
+        bus.on('hello', synchronous_failure)
+        bus.on('hello', synchronous)
+
+        with patch.object(smokesignal, '_log') as log:
+            d = bus.emit('hello', 'world')
+        assert log.error.called
+        return d.addCallback(self.assertEqual, [None, 'synchronous done'])
+
+    def test_error_policy_group(self):
+        """
+        Under the group policy, every callback is called and the failures are
+        raised together
+        """
+        bus = smokesignal.Dispatcher(error_policy='group')
+        bus.on('hello', synchronous_failure)
+        bus.on('hello', asynchronous_failure)
+        bus.on('hello', synchronous)
+
+        def check(f):
+            f.trap(smokesignal.EmitError)
+            errors = [type(e) for callback, e in f.value.failures]
+            assert errors == [ZeroDivisionError, KeyError]
+
+        d = bus.emit('hello', 'world')
+        d.addCallback(lambda r: self.fail('EmitError not raised'))
+        return d.addErrback(check)
+
+    def test_synchronous_fired(self):
+        """
+        When every callback returns synchronously, the deferred has already
+        fired with their results
+        """
+        smokesignal.on('hello', synchronous)
+        smokesignal.on('hello', lambda target: None)
+
+        d = smokesignal.emit('hello', 'world')
+        assert d.called
+        return d.addCallback(self.assertEqual, ['synchronous done', None])
+
+    def test_mixed_results_in_order(self):
+        """
+        Results of callbacks returning deferreds keep their place among the
+        synchronous results
+        """
+        smokesignal.on('hello', synchronous)
+        smokesignal.on('hello', delay)
+        smokesignal.on('hello', asynchronous)
+
+        clock = task.Clock()
+        with patch.object(reactor, 'callLater', clock.callLater):
+            d = smokesignal.emit('hello', 'world')
+            assert not d.called
+            clock.advance(20)
+
+        expected = ['synchronous done', 'delay done', 'asynchronous done']
+        return d.addCallback(self.assertEqual, expected)
+
+    def test_returned_failure(self):
+        """
+        Callbacks returning a Failure fail, as they would with maybeDeferred
+        """
+        smokesignal.once('hello', lambda target: failure.Failure(ZeroDivisionError()))
+        return self._emit(expectFailure=ZeroDivisionError)
+
     def test_delay(self):
         """
         Similar to test_asynchronous but use deferLater
@@ -96,6 +185,20 @@ class TestTwisted(unittest.TestCase):
             clock.advance(20)
             return r
 
+    def test_emit_lazy_unheard(self):
+        """
+        With nothing responding, emit_lazy still returns a deferred of no results
+        """
+        factory = lambda: self.fail('the payload was built')
+        smokesignal.on('hello', synchronous, match={'level': 'error'})
+
+        d = smokesignal.emit_lazy('hello', factory, level='info')
+        assert d.called
+        d.addCallback(self.assertEqual, [])
+
+        d = smokesignal.signal('hello').emit_lazy(factory)
+        return d.addCallback(self.assertEqual, [])
+
 
 def synchronous(target):
     """